@@ -0,0 +1,244 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+from json import loads as json_loads
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter, sleep
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import fixtures  # noqa: E402
+from stand_in_server import StandInHttpClient, StandInServer  # noqa: E402
+
+os.environ.setdefault("STAFF_BADGE", fixtures.STAFF_BADGE)
+
+import grabbers  # noqa: E402
+from delivery import DeliveryQueue  # noqa: E402
+from diffing import diff_items, diff_keyed  # noqa: E402
+from discord_implementation import Webhook  # noqa: E402
+from html_extraction import create_feeder  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from persistence import JsonStateStore, compact_ids, compact_staff  # noqa: E402
+from tenants import default_tenant_config  # noqa: E402
+
+
+class BenchService:
+    # Stands in for AutoNewsService, state lives in a temp directory and news go to the stand-in webhooks
+
+    def __init__(self, http_client, directory: str, webhooks: list = ()):
+        self.http_client = http_client
+        self.metrics = Metrics()
+        self.config = default_tenant_config()
+        self.news_count = 0
+        self._state = JsonStateStore(os.path.join(directory, "state"))
+        self._delivery_queue = DeliveryQueue(list(webhooks), os.path.join(directory, "pending_news.json")) \
+            if len(webhooks) > 0 else None
+
+    def get_from_save_data(self, namespace: str, config_key: str):
+        return self._state.get(namespace, config_key)
+
+    def add_save_data(self, namespace: str, config_key: str, value):
+        self._state.set(namespace, config_key, value)
+
+    def reset_save_data(self, namespace: str, save_data: dict):
+        for config_key, value in save_data.items():
+            self._state.set(namespace, config_key, value)
+
+    def emit_event(self, event_type: str, data: dict):
+        pass
+
+    def create_news(self, message_content: str, news_content: str):
+        self.news_count += 1
+        if self._delivery_queue is not None:
+            self._delivery_queue.submit(message_content, news_content)
+
+    def flush(self):
+        self._state.flush()
+
+    def wait_for_delivery(self, timeout: float = 60) -> bool:
+        deadline = perf_counter() + timeout
+        while self._delivery_queue.pending_count > 0:
+            if perf_counter() > deadline:
+                return False
+            sleep(0.01)
+        return True
+
+    def close(self):
+        if self._delivery_queue is not None:
+            self._delivery_queue.close()
+
+
+def measure(function, iterations: int) -> dict:
+    times = []
+    for _ in range(iterations):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    # Separate run, tracing slows everything down
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    percentiles = quantiles(times, n=100, method="inclusive") if len(times) > 1 else [times[0]] * 99
+    return {
+        "iterations": iterations,
+        "throughput": iterations / sum(times),
+        "p50": percentiles[49] * 1000,
+        "p90": percentiles[89] * 1000,
+        "p99": percentiles[98] * 1000,
+        "peak_kib": peak / 1024
+    }
+
+
+def feed(parser, payload: str, chunk_size: int = 16384):
+    # Same chunking as HttpClient.stream_if_modified
+    feeder = create_feeder(parser)
+    for position in range(0, len(payload), chunk_size):
+        feeder.feed(payload[position:position + chunk_size])
+        if parser.done:
+            return parser
+    feeder.close()
+    return parser
+
+
+def _alter_staff(staff: dict) -> dict:
+    # Every 10th member is new and every 7th got promoted
+    return {staff_uuid: dict(staff_data, rank="Jr " + staff_data["rank"]) if index % 7 == 0 else staff_data
+            for index, (staff_uuid, staff_data) in enumerate(staff.items()) if index % 10 != 0}
+
+
+def _shop_state(parser) -> dict:
+    return {
+        "items": {item_id: item_data["name"] for item_id, item_data in parser.stored_items.items()
+                  if item_data["category"] != "EMOTE"},
+        "categories": list(parser.shop_categories),
+        "banners": list(parser.banners),
+        "event": parser.event
+    }
+
+
+def create_cases(service: BenchService, routes: dict) -> list:
+    versions = routes["/dl.labymod.net/versions.json"].decode()
+    entries = routes["/dl.labymod.net/advertisement/entries.json"].decode()
+    badge = routes[f"/laby.net/badge/{fixtures.STAFF_BADGE}"].decode()
+    shop = routes["/labymod.net/shop"].decode()
+    advertisement_checker = grabbers.IngameAdvertisementChecker(service)
+    staff_parser = grabbers.StaffChecker._BadgeMemberParser()
+    shop_parser = grabbers.ShopChecker._ShopItemParser()
+
+    version = grabbers.VersionChecker.parse_version(json_loads(versions))
+    staff = dict(feed(staff_parser, badge).stored_staff_members)
+    old_staff = _alter_staff(staff)
+    shop_state = _shop_state(feed(shop_parser, shop))
+    old_items = list(shop_state["items"])[::2]
+    advertisement = list(advertisement_checker.parse_advertisement(json_loads(entries)))
+    old_advertisement = advertisement[1:]
+
+    return [
+        {
+            "grabber": grabbers.VersionChecker,
+            "parse": lambda: grabbers.VersionChecker.parse_version(json_loads(versions)),
+            "diff": lambda: version != "0.0.0",
+            "state": {"labymod_version": version},
+            "old_state": {"labymod_version": "0.0.0"}
+        },
+        {
+            "grabber": grabbers.StaffChecker,
+            "parse": lambda: feed(staff_parser, badge),
+            "diff": lambda: diff_keyed(old_staff, staff, lambda staff_data: staff_data["rank"]),
+            "state": {"labymod_staff": compact_staff(staff)},
+            "old_state": {"labymod_staff": compact_staff(old_staff)}
+        },
+        {
+            "grabber": grabbers.ShopChecker,
+            "parse": lambda: _shop_state(feed(shop_parser, shop)),
+            "diff": lambda: (diff_keyed(dict.fromkeys(old_items), shop_state["items"]),
+                             diff_items(shop_state["categories"][1:], shop_state["categories"]),
+                             diff_items(shop_state["banners"][1:], shop_state["banners"])),
+            "state": {"labymod_shop": {"items": compact_ids(shop_state["items"]), "categories": shop_state["categories"],
+                                       "event": shop_state["event"]}, "top_banner": shop_state["banners"]},
+            "old_state": {"labymod_shop": {"items": compact_ids(old_items), "categories": shop_state["categories"][1:],
+                                           "event": None}, "top_banner": shop_state["banners"][1:]}
+        },
+        {
+            "grabber": grabbers.IngameAdvertisementChecker,
+            "parse": lambda: advertisement_checker.parse_advertisement(json_loads(entries)),
+            "diff": lambda: diff_items(old_advertisement, advertisement),
+            "state": {"ingame_advertisement": advertisement},
+            "old_state": {"ingame_advertisement": old_advertisement}
+        }
+    ]
+
+
+def persist(directory: str, namespace: str, state: dict):
+    store = JsonStateStore(os.path.join(directory, "persist"))
+    for config_key, value in state.items():
+        store.set(namespace, config_key, value)
+    store.flush()
+
+
+def print_result(grabber: str, phase: str, scale: int, result: dict):
+    print(f"{grabber:<28}{phase:<9}{scale:>6}x{result['iterations']:>7}{result['throughput']:>12.1f}"
+          f"{result['p50']:>10.3f}{result['p90']:>10.3f}{result['p99']:>10.3f}{result['peak_kib']:>12.1f}")
+
+
+def run(scales: list, iterations: int, webhook_count: int, end_to_end: bool):
+    print(f"{'grabber':<28}{'phase':<9}{'scale':>7}{'runs':>7}{'ops/s':>12}{'p50 ms':>10}{'p90 ms':>10}"
+          f"{'p99 ms':>10}{'peak KiB':>12}")
+    for scale in scales:
+        routes = fixtures.routes(scale)
+        # Bigger payloads get fewer runs
+        runs = max(3, iterations // scale)
+        with tempfile.TemporaryDirectory() as directory, StandInServer(routes) as server:
+            http_client = StandInHttpClient(server.url, os.path.join(directory, "http_cache.json"))
+            webhooks = [Webhook(f"{server.url}/webhook/{index}", http_client) for index in range(webhook_count)]
+            service = BenchService(http_client, directory, webhooks if end_to_end else ())
+            for case in create_cases(service, routes):
+                name = case["grabber"].__name__
+                print_result(name, "parse", scale, measure(case["parse"], runs))
+                print_result(name, "diff", scale, measure(case["diff"], runs))
+                print_result(name, "persist", scale, measure(lambda: persist(directory, name, case["state"]), runs))
+                if not end_to_end:
+                    continue
+                grabber = case["grabber"](service)
+
+                def tick():
+                    service.reset_save_data(name, case["old_state"])
+                    http_client.clear_fetch_cache()
+                    grabber.tick()
+                print_result(name, "tick", scale, measure(tick, runs))
+
+            if end_to_end:
+                # Every news goes to every webhook, bursts are sent as digests
+                start = perf_counter()
+                delivered = service.wait_for_delivery()
+                duration = perf_counter() - start
+                print(f"Fan-out at {scale}x: {service.news_count * webhook_count} news in {server.webhook_posts} "
+                      f"webhook post(s), drained {duration:.3f}s after the last tick"
+                      f"{'' if delivered else ' (timed out)'}, {server.bytes_sent / 1024:.1f} KiB served.")
+            service.close()
+            http_client.close()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Benchmarks parse, diff, persist and tick per grabber "
+                                                          "against recorded payloads.")
+    argument_parser.add_argument("--scales", default="1,10,100,1000",
+                                 help="Comma separated payload scale factors.")
+    argument_parser.add_argument("--iterations", type=int, default=200, help="Runs at scale 1.")
+    argument_parser.add_argument("--webhooks", type=int, default=3, help="Stand-in webhooks for the fan-out.")
+    argument_parser.add_argument("--no-tick", action="store_true", help="Skip the end-to-end tick runs.")
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    run([int(scale) for scale in arguments.scales.split(",")], arguments.iterations, arguments.webhooks,
+        not arguments.no_tick)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import fixtures  # noqa: E402
+from bench_grabbers import feed, measure  # noqa: E402
+
+import grabbers  # noqa: E402
+from auto_news import setup_logging  # noqa: E402
+
+_lazy_debug = logging.debug
+
+
+def _eager_debug(message, *arguments, **keywords):
+    # Formats like the f-strings used before, whether DEBUG is enabled or not
+    _lazy_debug(message % arguments if arguments else message, **keywords)
+
+
+def _reset_root():
+    for handler in list(logging.root.handlers):
+        logging.root.removeHandler(handler)
+        handler.close()
+
+
+def run(scale: int, iterations: int):
+    shop = fixtures.shop_html(scale)
+    parser = grabbers.ShopChecker._ShopItemParser()
+
+    def parse():
+        feed(parser, shop)
+
+    print(f"Full shop page parse at {scale}x ({len(shop) / 1024:.0f} KiB), {iterations} run(s)")
+    print(f"{'setup':<40}{'p50 ms':>10}{'p90 ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        log_file = os.path.join(directory, "auto_news.log")
+
+        # DEBUG off, the old f-strings were formatted anyway
+        _reset_root()
+        logging.root.setLevel(logging.INFO)
+        logging.root.addHandler(logging.FileHandler(log_file, encoding="utf-8"))
+        logging.debug = _eager_debug
+        result = measure(parse, iterations)
+        logging.debug = _lazy_debug
+        print(f"{'INFO, eager formatting (before)':<40}{result['p50']:>10.3f}{result['p90']:>10.3f}")
+        result = measure(parse, iterations)
+        print(f"{'INFO, lazy formatting (after)':<40}{result['p50']:>10.3f}{result['p90']:>10.3f}")
+
+        # DEBUG on, cost of writing the records on the parsing thread
+        logging.root.setLevel(logging.DEBUG)
+        result = measure(parse, iterations)
+        print(f"{'DEBUG, file handler on thread (before)':<40}{result['p50']:>10.3f}{result['p90']:>10.3f}")
+        _reset_root()
+        listener = setup_logging(logging.DEBUG, log_file)
+        # Console output would only measure the terminal
+        listener.handlers = listener.handlers[:1]
+        result = measure(parse, iterations)
+        listener.stop()
+        print(f"{'DEBUG, queue handler (after)':<40}{result['p50']:>10.3f}{result['p90']:>10.3f}")
+        _reset_root()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Compares shop parsing with the old and new logging setup.")
+    argument_parser.add_argument("--scale", type=int, default=100, help="Shop page scale factor.")
+    argument_parser.add_argument("--iterations", type=int, default=10)
+    arguments = argument_parser.parse_args()
+    run(arguments.scale, arguments.iterations)
+
+
+if __name__ == "__main__":
+    main()
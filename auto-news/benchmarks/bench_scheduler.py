@@ -0,0 +1,106 @@
+import argparse
+import sys
+from bisect import bisect_right
+from pathlib import Path
+from random import Random
+from statistics import mean, quantiles
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from scheduler import Scheduler  # noqa: E402
+
+DAY = 24 * 3600
+
+
+class SimulatedSource:
+    # Changes come in bursts, like a release followed by hotfixes
+
+    def __init__(self, name: str, interval: int, burst_every: float, random: Random, days: int):
+        self.name = name
+        self.interval = interval
+        self.changes = []
+        time = random.expovariate(1 / burst_every)
+        while time < days * DAY:
+            burst_time = time
+            for _ in range(random.randint(1, 4)):
+                self.changes.append(burst_time)
+                burst_time += random.uniform(600, 3600)
+            time += random.expovariate(1 / burst_every)
+        self.changes = sorted(change for change in self.changes if change < days * DAY)
+
+    def get_interval(self) -> int:
+        return self.interval
+
+
+def _poll(source: SimulatedSource, last_poll: float, now: float, latencies: list) -> bool:
+    # Every change since the last poll is detected now
+    start = bisect_right(source.changes, last_poll)
+    end = bisect_right(source.changes, now)
+    latencies.extend(now - change for change in source.changes[start:end])
+    return end > start
+
+
+def simulate_fixed(source: SimulatedSource, days: int) -> tuple[int, list]:
+    # The old scheme, a fixed interval on a shared clock
+    latencies = []
+    polls = 0
+    last_poll = 0.0
+    now = 0.0
+    while now < days * DAY:
+        polls += 1
+        _poll(source, last_poll, now, latencies)
+        last_poll = now
+        now += source.interval
+    return polls, latencies
+
+
+def simulate_scheduler(source: SimulatedSource, days: int, random: Random) -> tuple[int, list]:
+    scheduler = Scheduler(random)
+    scheduler.add(source.name, 0.0)
+    latencies = []
+    polls = 0
+    last_poll = 0.0
+    while True:
+        now = scheduler.next_deadline()
+        if now >= days * DAY:
+            break
+        scheduler.pop_due(now)
+        polls += 1
+        changed = _poll(source, last_poll, now, latencies)
+        last_poll = now
+        scheduler.complete(source.name, now, source.get_interval(), changed=changed)
+    return polls, latencies
+
+
+def _format(polls: int, latencies: list) -> str:
+    if len(latencies) < 2:
+        return f"{polls:>8}{'-':>12}{'-':>12}"
+    return f"{polls:>8}{mean(latencies) / 60:>12.1f}{quantiles(latencies, n=10)[8] / 60:>12.1f}"
+
+
+def run(days: int, seed: int):
+    random = Random(seed)
+    sources = [
+        SimulatedSource("VersionChecker", 300, 3 * DAY, random, days),
+        SimulatedSource("StaffChecker", 3600, 7 * DAY, random, days),
+        SimulatedSource("ShopChecker", 3600, 2 * DAY, random, days),
+        SimulatedSource("IngameAdvertisementChecker", 1800, 4 * DAY, random, days)
+    ]
+    print(f"{days} simulated day(s), latency in minutes")
+    print(f"{'grabber':<28}{'changes':>8}{'scheme':>11}{'polls':>8}{'mean':>12}{'p90':>12}")
+    for source in sources:
+        print(f"{source.name:<28}{len(source.changes):>8}{'fixed':>11}{_format(*simulate_fixed(source, days))}")
+        print(f"{'':<36}{'adaptive':>11}{_format(*simulate_scheduler(source, days, random))}")
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Compares polls and detection latency of the fixed "
+                                                          "intervals and the adaptive scheduler on simulated changes.")
+    argument_parser.add_argument("--days", type=int, default=90)
+    argument_parser.add_argument("--seed", type=int, default=1)
+    arguments = argument_parser.parse_args()
+    run(arguments.days, arguments.seed)
+
+
+if __name__ == "__main__":
+    main()
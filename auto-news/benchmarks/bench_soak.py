@@ -0,0 +1,83 @@
+import argparse
+import gc
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import fixtures  # noqa: E402
+from stand_in_server import StandInHttpClient, StandInServer  # noqa: E402
+
+os.environ.setdefault("STAFF_BADGE", fixtures.STAFF_BADGE)
+
+import grabbers  # noqa: E402
+from bench_grabbers import BenchService  # noqa: E402
+
+
+def rss_bytes() -> int:
+    # Current resident set, ru_maxrss would only show the peak
+    try:
+        with open("/proc/self/statm", "r") as file_in:
+            return int(file_in.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(rounds: int, scale: int, max_growth_mib: float) -> bool:
+    # Pages switch between two versions every other round, so ticks alternate between changes and unchanged pages
+    variants = [fixtures.routes(scale), fixtures.routes(scale + 1)]
+    with tempfile.TemporaryDirectory() as directory, StandInServer(variants[0], send_validators=True) as server:
+        http_client = StandInHttpClient(server.url, os.path.join(directory, "http_cache.json"))
+        service = BenchService(http_client, directory)
+        grabber_list = [grabber_class(service) for grabber_class in (grabbers.VersionChecker, grabbers.StaffChecker,
+                                                                     grabbers.ShopChecker,
+                                                                     grabbers.IngameAdvertisementChecker)]
+        # Caches and pools fill up during the warm up, growth after that is what piles up per tick
+        warm_up = max(rounds // 10, 1)
+        samples = []
+        start = perf_counter()
+        for round_number in range(rounds):
+            server.routes = variants[round_number // 2 % 2]
+            http_client.clear_fetch_cache()
+            for grabber in grabber_list:
+                grabber.tick()
+                http_client.commit_validators()
+            service.flush()
+            if round_number + 1 == warm_up or (round_number + 1) % max(rounds // 20, 1) == 0:
+                gc.collect()
+                samples.append((round_number + 1, rss_bytes()))
+        duration = perf_counter() - start
+        http_client.close()
+
+    ticks = rounds * len(grabber_list)
+    baseline = next(rss for round_number, rss in samples if round_number >= warm_up)
+    growth = (samples[-1][1] - baseline) / 1024 / 1024
+    print(f"{ticks} tick(s) in {duration:.1f}s at scale {scale}x, {service.news_count} news")
+    print(f"{'round':>8}{'RSS MiB':>10}")
+    for round_number, rss in samples:
+        print(f"{round_number:>8}{rss / 1024 / 1024:>10.1f}")
+    passed = growth <= max_growth_mib
+    print(f"RSS growth after warm up {growth:+.1f} MiB, limit {max_growth_mib:.1f} MiB: "
+          f"{'passed' if passed else 'failed'}")
+    return passed
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Runs all grabbers for many rounds against the stand-in "
+                                                          "server and checks that the resident memory stays flat.")
+    argument_parser.add_argument("--rounds", type=int, default=1000, help="Rounds of one tick per grabber.")
+    argument_parser.add_argument("--scale", type=int, default=10, help="Payload scale factor.")
+    argument_parser.add_argument("--max-growth-mib", type=float, default=2.0,
+                                 help="Allowed RSS growth between the end of the warm up and the last round.")
+    arguments = argument_parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(0 if run(arguments.rounds, arguments.scale, arguments.max_growth_mib) else 1)
+
+
+if __name__ == "__main__":
+    main()
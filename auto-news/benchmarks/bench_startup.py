@@ -0,0 +1,93 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from statistics import quantiles
+from threading import Lock
+from time import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import fixtures  # noqa: E402
+from stand_in_server import StandInServer  # noqa: E402
+
+
+def child():
+    # Runs the service against the stand-in server and reports when the first grabber ran, timed from the spawn
+    import auto_news  # noqa: E402
+    import grabbers  # noqa: F401, E402
+    from stand_in_server import StandInHttpClient  # noqa: E402
+
+    imported = time()
+    base_url = os.environ["STAND_IN_URL"]
+    auto_news.HttpClient = lambda metrics: StandInHttpClient(base_url, "./http_cache.json", metrics)
+    run_grabber = auto_news.AutoNewsService._run_grabber
+
+    reported = Lock()
+
+    def first_run(service, name: str) -> bool:
+        started = time()
+        changed = run_grabber(service, name)
+        # Grabbers run in parallel, only the first one reports
+        if reported.acquire(blocking=False):
+            with open("first_tick.txt", "w", encoding="UTF-8") as file_out:
+                file_out.write(f"{imported} {started} {time()}")
+            os._exit(0)
+        return changed
+
+    auto_news.AutoNewsService._run_grabber = first_run
+    auto_news.AutoNewsService()
+
+
+def run(runs: int, target_ms: float) -> bool:
+    results = {"imports": [], "first tick start": [], "first tick done": []}
+    with tempfile.TemporaryDirectory() as directory, StandInServer(fixtures.routes(1)) as server:
+        environment = dict(os.environ, STAND_IN_URL=server.url, STAFF_BADGE=fixtures.STAFF_BADGE,
+                           DISCORD_WEBHOOKS=f"{server.url}/webhook/0", SCHEDULER_START_SPREAD="0")
+        # The first start creates the state, the others are restarts like in a rolling deploy
+        for _ in range(runs + 1):
+            spawned = time()
+            subprocess.run([sys.executable, __file__, "--child"], cwd=directory, env=environment,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+            # Written by the child, the console is taken by the service's logging
+            marker_path = os.path.join(directory, "first_tick.txt")
+            if not os.path.exists(marker_path):
+                raise RuntimeError("The service didn't run a grabber.")
+            with open(marker_path, "r", encoding="UTF-8") as file_in:
+                imported, started, done = (float(value) for value in file_in.read().split())
+            os.unlink(marker_path)
+            results["imports"].append(imported - spawned)
+            results["first tick start"].append(started - spawned)
+            results["first tick done"].append(done - spawned)
+
+    print(f"Startup over {runs} restart(s), ms from spawn")
+    print(f"{'until':<20}{'first start':>12}{'p50':>10}{'p90':>10}")
+    for name, values in results.items():
+        restarts = values[1:]
+        percentiles = quantiles(restarts, n=10, method="inclusive") if len(restarts) > 1 else [restarts[0]] * 9
+        print(f"{name:<20}{values[0] * 1000:>12.1f}{percentiles[4] * 1000:>10.1f}{percentiles[8] * 1000:>10.1f}")
+    first_tick_p90 = quantiles(results["first tick done"][1:], n=10, method="inclusive")[8] * 1000 \
+        if runs > 1 else results["first tick done"][1] * 1000
+    passed = first_tick_p90 <= target_ms
+    print(f"First tick p90 {first_tick_p90:.1f}ms, target {target_ms:.0f}ms: {'passed' if passed else 'failed'}")
+    return passed
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Measures the time from process spawn to the first "
+                                                          "finished grabber run against the stand-in server.")
+    argument_parser.add_argument("--runs", type=int, default=10)
+    argument_parser.add_argument("--target-ms", type=float, default=500,
+                                 help="Budget for the p90 of the first finished grabber run.")
+    argument_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    arguments = argument_parser.parse_args()
+    if arguments.child:
+        child()
+        return
+    sys.exit(0 if run(arguments.runs, arguments.target_ms) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import re
+from json import dumps as json_dumps, loads as json_loads
+from pathlib import Path
+from uuid import UUID
+
+FIXTURE_DIRECTORY = Path(__file__).parent / "fixtures"
+STAFF_BADGE = "d2a2c2a2-1a1a-4b4b-8c8c-0d0d0d0d0d0d"
+
+_ARTICLE_PATTERN = re.compile(r"[ \t]*<article .*?</article>\n", re.DOTALL)
+_STAFF_PATTERN = re.compile(r"[ \t]*<a href=\"/@.*?</a>\n", re.DOTALL)
+
+
+def load(name: str) -> str:
+    return (FIXTURE_DIRECTORY / name).read_text(encoding="UTF-8")
+
+
+def shop_html(scale: int = 1) -> str:
+    html = load("shop.html")
+    articles = _ARTICLE_PATTERN.findall(html)
+    # Every copy gets its own ids and names, so the catalogue really grows
+    extra = "".join(re.sub(r'data-item-id="(\d+)"', lambda match: f'data-item-id="{int(match[1]) + copy * 1000}"',
+                           article).replace('data-item-name="', f'data-item-name="#{copy} ')
+                    for copy in range(1, scale) for article in articles)
+    position = html.index(articles[0]) + len(articles[0])
+    return html[:position] + extra + html[position:]
+
+
+def badge_html(scale: int = 1) -> str:
+    html = load("badge.html")
+    members = _STAFF_PATTERN.findall(html)
+    extra = "".join(re.sub(r"/@[0-9a-f-]+", f"/@{UUID(int=copy * 100 + index)}", member)
+                    .replace("</a>", f" {copy}</a>")
+                    for copy in range(1, scale) for index, member in enumerate(members))
+    position = html.index(members[0]) + len(members[0])
+    return html[:position] + extra + html[position:]
+
+
+def versions_json(scale: int = 1) -> str:
+    versions = json_loads(load("versions.json"))
+    for copy in range(1, scale):
+        versions[f"1.{copy + 100}.0"] = dict(versions["1.8.9"])
+    return json_dumps(versions)
+
+
+def entries_json(scale: int = 1) -> str:
+    entries = json_loads(load("entries.json"))
+    for side in ("left", "right"):
+        entries[side] = [dict(entry, title=f"{entry['title']} #{copy}") if copy > 0 else entry
+                         for copy in range(scale) for entry in entries[side]]
+    return json_dumps(entries)
+
+
+def routes(scale: int = 1) -> dict:
+    # Paths as served by the stand-in server, prefixed with the original host
+    return {
+        "/dl.labymod.net/versions.json": versions_json(scale).encode(),
+        "/dl.labymod.net/advertisement/entries.json": entries_json(scale).encode(),
+        f"/laby.net/badge/{STAFF_BADGE}": badge_html(scale).encode(),
+        "/labymod.net/shop": shop_html(scale).encode()
+    }
@@ -0,0 +1,98 @@
+import sys
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Condition, Thread
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from http_client import HttpClient  # noqa: E402
+
+
+class StandInServer:
+    # Serves recorded payloads and accepts webhook posts, so nothing touches the network
+
+    def __init__(self, routes: dict, send_validators: bool = False):
+        self.routes = routes
+        self.send_validators = send_validators
+        self.webhook_posts = 0
+        self.bytes_sent = 0
+        self._posted = Condition()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_handler())
+        self._server.daemon_threads = True
+        # Clients going away mid request aren't errors here
+        self._server.handle_error = lambda request, client_address: None
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body = server.routes.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = f'"{blake2b(body, digest_size=8).hexdigest()}"'
+                if server.send_validators and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json" if self.path.endswith(".json")
+                                 else "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if server.send_validators:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                server.bytes_sent += len(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", "0")))
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                with server._posted:
+                    server.webhook_posts += 1
+                    server._posted.notify_all()
+
+            def log_message(self, *arguments):
+                pass
+
+        return Handler
+
+    def wait_for_posts(self, count: int, timeout: float = 60) -> bool:
+        with self._posted:
+            return self._posted.wait_for(lambda: self.webhook_posts >= count, timeout)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exception_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StandInHttpClient(HttpClient):
+    # Routes https://host/path to the stand-in server as /host/path
+
+    def __init__(self, base_url: str, validator_cache_path: str, metrics=None):
+        super().__init__(validator_cache_path, metrics)
+        self._base_url = base_url
+
+    def request(self, method: str, url: str, **kwargs):
+        parts = urlsplit(url)
+        if not url.startswith(self._base_url):
+            url = f"{self._base_url}/{parts.hostname}{parts.path}"
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,63 @@
+import logging
+import os
+import zlib
+from hashlib import blake2b
+from json import loads as json_loads
+from threading import Lock
+from time import time
+
+from persistence import encode
+
+
+class PayloadArchive:
+    # Fetched payloads stored once per content hash, plus an index of every fetch with its wall clock time
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self._lock = Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        # Last fetch of every url, a 304 means its content is still the same
+        self._last_entries = {}
+        entries = self.read_entries()
+        for entry in entries:
+            self._last_entries[entry["url"]] = entry
+        logging.info(f"PayloadArchive: Opened {directory} with {len(entries)} fetch(es).")
+
+    def read_entries(self) -> list[dict]:
+        try:
+            with open(self._index_path, "r", encoding="UTF-8") as file_in:
+                return [json_loads(line) for line in file_in if line.strip() != ""]
+        except FileNotFoundError:
+            return []
+
+    def record(self, url: str, content: bytes, encoding: str = None):
+        content_hash = blake2b(content, digest_size=16).hexdigest()
+        path = self._object_path(content_hash)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f"{path}.tmp", "wb") as file_out:
+                    file_out.write(zlib.compress(content, 9))
+                os.replace(f"{path}.tmp", path)
+                logging.debug("PayloadArchive: Stored %s for %s (%s bytes).", content_hash, url, len(content))
+            self._append({"time": time(), "url": url, "hash": content_hash, "encoding": encoding})
+
+    def record_unchanged(self, url: str):
+        with self._lock:
+            last_entry = self._last_entries.get(url)
+            if last_entry is None:
+                return
+            self._append(dict(last_entry, time=time()))
+
+    def _append(self, entry: dict):
+        self._last_entries[entry["url"]] = entry
+        with open(self._index_path, "a", encoding="UTF-8") as file_out:
+            file_out.write(encode(entry) + "\n")
+
+    def load(self, content_hash: str) -> bytes:
+        with open(self._object_path(content_hash), "rb") as file_in:
+            return zlib.decompress(file_in.read())
+
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self._directory, "objects", content_hash[:2], content_hash)
@@ -1,97 +1,386 @@
+import argparse
 import logging
 import os
 import sys
-from abc import ABC, abstractmethod
-from json import load as json_load, dump as json_dump
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import blake2b
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Empty, SimpleQueue
+from threading import get_ident
+from time import monotonic, perf_counter, time
 
 from dotenv import load_dotenv
 
-import grabbers
+from archive import PayloadArchive
+from coordination import create_coordinator
+from delivery import DeliveryQueue
 from discord_implementation import Webhook
+from events import create_event_store, query_events
+from health import Watchdog
+from http_client import HttpClient
+from isolation import GrabberWorker
+from local_server import LocalServer
+from metrics import Metrics
+from persistence import create_state_store, encode
+from registry import get_grabber_class
+from replay import run_replay
+from scheduler import Scheduler
+from tenants import TenantContext, load_tenant_configs
 
 
 class AutoNewsService:
 
-    def __init__(self):
+    def __init__(self, archive_path: str = None):
         load_dotenv()
-        # Setup logging
-        logging.basicConfig(filename="auto_news.log", filemode="w", encoding="utf-8",
-                            level=logging.DEBUG if os.getenv("DEBUG") == "TRUE" else logging.INFO,
-                            format="(%(asctime)s) [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-        stream_handler = logging.StreamHandler(sys.stdout)
-        stream_handler.addFilter(LevelRangeLoggingFilter(logging.DEBUG, logging.INFO))
-        formatter = logging.Formatter("(%(asctime)s) [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S", "%")
-        stream_handler.setFormatter(formatter)
-        logging.root.addHandler(stream_handler)
-        error_handler = logging.StreamHandler(sys.stderr)
-        error_handler.addFilter(LevelRangeLoggingFilter(logging.WARNING, logging.CRITICAL))
-        error_handler.setFormatter(formatter)
-        logging.root.addHandler(error_handler)
-
-        webhook_target_role = os.getenv("DISCORD_ROLE")
-        logging.info(f"Loaded {webhook_target_role} as target role.")
-        self._webhooks = [Webhook(url, webhook_target_role) for url in os.getenv("DISCORD_WEBHOOKS").split(";")]
-        logging.info(f"Loaded {len(self._webhooks)} webhook(s).")
-        self._grabbers = [grabbers.VersionChecker(self), grabbers.StaffChecker(self), grabbers.ShopChecker(self),
-                          grabbers.IngameAdvertisementChecker(self)]
-        logging.info(f"Got {len(self._grabbers)} grabber(s).")
-        self._max_interval = max(grabber.get_interval() for grabber in self._grabbers)
-        logging.debug(f"Max interval of {self._max_interval}")
-        self._current_tick = 0
-
-        # Save data
-        try:
-            with open("./news_data.json", "r", encoding="UTF-8") as file_in:
-                self._save_data = json_load(file_in)
-            logging.info("Loaded save data from file.")
-        except FileNotFoundError:
-            self._save_data = {}
-            logging.warning("No save date file found.")
-
-        logging.info("Ticket start")
+        self._log_listener = setup_logging(logging.DEBUG if os.getenv("DEBUG") == "TRUE" else logging.INFO)
+
+        self.metrics = Metrics()
+        # Shared by all grabbers and webhooks to reuse connections
+        self.http_client = HttpClient(metrics=self.metrics)
+        if archive_path is not None:
+            self.http_client.archive = PayloadArchive(archive_path)
+
+        self._tenants = [TenantContext(self, tenant_config) for tenant_config in load_tenant_configs()]
+        # Tenants posting to the same url share the webhook
+        webhooks = {}
+        for tenant in self._tenants:
+            logging.info(f"Loaded {tenant.config['role']} as target role for tenant {tenant.name}.")
+            for url in tenant.config["webhooks"]:
+                webhooks.setdefault(url, Webhook(url, self.http_client, tenant.config["role"]))
+        logging.info(f"Loaded {len(webhooks)} webhook(s).")
+        # Messages are sent in the background, so grabbers don't wait for discord
+        self._delivery_queue = DeliveryQueue(list(webhooks.values()), metrics=self.metrics)
+        # Grabbers are created on their first run, so the first one starts without waiting for the others
+        self._grabber_classes = {tenant.label(grabber_name): (tenant, grabber_name) for tenant in self._tenants
+                                 for grabber_name in tenant.config["grabbers"]}
+        self._grabbers = {}
+        # Unknown names fail here instead of on their first run
+        for _, grabber_name in self._grabber_classes.values():
+            get_grabber_class(grabber_name)
+        logging.info(f"Got {len(self._grabber_classes)} grabber(s).")
+        self._grabber_timeout = float(os.getenv("GRABBER_TIMEOUT", "50"))
+        logging.debug(f"Grabber timeout of {self._grabber_timeout}s")
+        # Threads can't be killed, a run stuck for this long is left behind and its grabber moves to a worker process
+        self._abandon_timeout = float(os.getenv("GRABBER_ABANDON_TIMEOUT", "300"))
+        self._isolate_stuck = archive_path is None
+        # ISOLATED_GRABBERS=* or names run in worker processes, recordings only see this process
+        isolated = set((os.getenv("ISOLATED_GRABBERS") or "").split(";")) - {""} if archive_path is None else set()
+        self._workers = {name: GrabberWorker(name, tenant.config, grabber_name, self._grabber_timeout)
+                         for name, (tenant, grabber_name) in self._grabber_classes.items()
+                         if "*" in isolated or name in isolated or grabber_name in isolated}
+        if len(self._workers) > 0:
+            logging.info(f"Running {', '.join(self._workers)} in worker processes.")
+        # Room for one abandoned run per grabber, a grabber can't get stuck in this process twice
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self._grabber_classes), thread_name_prefix="grabber")
+        self._scheduler = Scheduler()
+        # The same grabber of all tenants runs together, so they share its downloads
+        for name, (_, grabber_name) in self._grabber_classes.items():
+            self._scheduler.add(name, monotonic(), grabber_name)
+        # Start time and future of running grabbers by name, a grabber is only scheduled again once it finished
+        self._running = {}
+        self._timed_out = set()
+        # Grabber names of abandoned runs by future
+        self._abandoned = {}
+        self._finished = SimpleQueue()
+        # Wall time of the last successful run by name
+        self._last_success = {}
+
+        # Save data, written behind once per tick
+        self._state = create_state_store()
+        # History of typed change events, written with the state
+        self._event_store = create_event_store()
+        # Optional coordination with other instances sharing the state
+        self._coordinator = create_coordinator(self.metrics)
+        self._owned = set()
+
+        self._last_flush = time()
+        self._flush_failing_since = None
+        self._ticking = False
+        self._exit_on_stall = os.getenv("WATCHDOG_EXIT") == "TRUE"
+        self._watchdog = Watchdog(get_ident(), self._on_stall)
+
+        # Optional local endpoint for metrics and health checks
+        self._local_server = None
+        if os.getenv("LOCAL_SERVER_PORT") is not None:
+            self._local_server = LocalServer(os.getenv("LOCAL_SERVER_HOST", "127.0.0.1"),
+                                             int(os.getenv("LOCAL_SERVER_PORT")))
+            self._local_server.add_route("/metrics", lambda query: (200, "text/plain; version=0.0.4",
+                                                                   self.metrics.render()))
+            self._local_server.add_route("/events", lambda query: query_events(self._event_store, query))
+            self._local_server.add_route("/health", lambda query: self._health(False))
+            self._local_server.add_route("/ready", lambda query: self._health(True))
+            self._local_server.start()
+
+        logging.info("Scheduler start")
+        self._watchdog.start()
         try:
             self._ticker()
         except KeyboardInterrupt:
             pass
+        finally:
+            self._watchdog.close()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            for worker in self._workers.values():
+                worker.close()
+            self._flush()
+            self._state.close()
+            self._event_store.close()
+            if self._coordinator is not None:
+                self._coordinator.close()
+            self._delivery_queue.close()
+            self.http_client.close()
+            if self._local_server is not None:
+                self._local_server.close()
 
         logging.info("App stopped.")
+        self._log_listener.stop()
+        if len(self._abandoned) > 0:
+            # The interpreter would join the stuck threads forever
+            os._exit(0)
 
-    def get_from_save_data(self, config_key: str):
-        try:
-            return self._save_data[config_key]
-        except KeyError:
-            return None
+    def get_from_save_data(self, namespace: str, config_key: str):
+        return self._state.get(namespace, config_key)
 
-    def add_save_data(self, config_key: str, value):
-        self._save_data[config_key] = value
-        # Write
-        with open("./news_data.json", "w", encoding="UTF-8") as file:
-            json_dump(self._save_data, file, indent=4)
-        logging.debug(f"Wrote to data:  {config_key} : {value}")
+    def add_save_data(self, namespace: str, config_key: str, value):
+        with self.metrics.time_phase("persist"):
+            self._state.set(namespace, config_key, value)
+        logging.debug("Wrote to data: %s %s : %s", namespace, config_key, value)
+
+    def _flush(self):
+        try:
+            with self.metrics.time("auto_news_state_flush_seconds"):
+                self._state.flush()
+                self._event_store.flush()
+            self.http_client.flush_validators()
+        except OSError as exception:
+            logging.exception(exception)
+            if self._flush_failing_since is None:
+                self._flush_failing_since = time()
+            return
+        self._last_flush = time()
+        self._flush_failing_since = None
 
     def _ticker(self):
         while True:
-            logging.debug(f"Started tick {self._current_tick}")
-            for grabber in self._grabbers:
-                if self._current_tick % grabber.get_interval() == 0:
-                    logging.info(f"Run grabber: {type(grabber).__name__}")
-                    try:
-                        grabber.tick()
-                    except Exception as exception:
-                        logging.exception(exception)
-
-            self._current_tick += 1
-            if self._current_tick >= self._max_interval:
-                self._current_tick = 0
-
-            sleep(60)
-
-    def create_news(self, message_content: str, news_content: str):
+            self._watchdog.beat()
+            self._ticking = True
+            for name, lag in self._scheduler.pop_due(monotonic()):
+                if self._owns(name):
+                    self._start_grabber(name, lag)
+                else:
+                    self._scheduler.postpone(name, monotonic(), self._coordinator.heartbeat_interval)
+            self._check_timeouts()
+
+            # Sleep until the next grabber is due, one times out or one finished
+            deadline = self._scheduler.next_deadline()
+            wake_up = [monotonic() + 60 if deadline is None else deadline]
+            wake_up += [start + (self._abandon_timeout if name in self._timed_out else self._grabber_timeout)
+                        for name, (start, _) in self._running.items()]
+            try:
+                finished = [self._finished.get(timeout=max(min(wake_up) - monotonic(), 0))]
+            except Empty:
+                continue
+            # Everything that finished meanwhile is written at once
+            while not self._finished.empty():
+                finished.append(self._finished.get())
+            for name, future in finished:
+                self._complete_grabber(name, future)
+            self._flush()
+            self._update_connection_metrics()
+
+    def _owns(self, name: str) -> bool:
+        if self._coordinator is None:
+            return True
+        owned = self._coordinator.owns(name)
+        if owned and name not in self._owned:
+            logging.info(f"Took over grabber {name}.")
+            # The previous owner kept writing it
+            self._state.invalidate(name)
+            self._owned.add(name)
+        elif not owned and name in self._owned:
+            logging.info(f"Handed over grabber {name}.")
+            self._owned.discard(name)
+        return owned
+
+    def _get_grabber(self, name: str):
+        grabber = self._grabbers.get(name)
+        if grabber is None:
+            tenant, grabber_name = self._grabber_classes[name]
+            grabber = self._grabbers[name] = get_grabber_class(grabber_name)(tenant)
+        return grabber
+
+    def _start_grabber(self, name: str, lag: float):
+        logging.info(f"Run grabber: {name}")
+        self.metrics.set("auto_news_grabber_lag_seconds", lag, grabber=name)
+        start = monotonic()
+        future = self._executor.submit(self._run_grabber, name)
+        self._running[name] = (start, future)
+        future.add_done_callback(lambda done: self._finished.put((name, done)))
+
+    def _check_timeouts(self):
+        now = monotonic()
+        for name, (start, future) in list(self._running.items()):
+            if name not in self._timed_out and now - start > self._grabber_timeout:
+                logging.error(f"Grabber {name} timed out after {self._grabber_timeout}s.")
+                self._timed_out.add(name)
+            # Worker processes are killed by their own timeout
+            elif name in self._timed_out and name not in self._workers and now - start > self._abandon_timeout:
+                self._abandon_grabber(name, future)
+
+    def _abandon_grabber(self, name: str, future: Future):
+        self.metrics.inc("auto_news_grabber_abandoned_total", grabber=name)
+        del self._running[name]
+        self._timed_out.discard(name)
+        self._abandoned[future] = name
+        if self._isolate_stuck:
+            logging.error(f"Grabber {name} is stuck for {self._abandon_timeout}s, running it in a worker process "
+                          f"from now on.")
+            interval = self._get_interval(name)
+            # The stuck run keeps its instance, the worker creates its own
+            self._grabbers.pop(name, None)
+            tenant, grabber_name = self._grabber_classes[name]
+            self._workers[name] = GrabberWorker(name, tenant.config, grabber_name, self._grabber_timeout)
+            self._scheduler.complete(name, monotonic(), interval, failed=True)
+        else:
+            # Recordings only see this process, the grabber waits for its run instead
+            logging.error(f"Grabber {name} is stuck for {self._abandon_timeout}s, pausing it until the run returns.")
+        self._on_stall()
+
+    def _complete_grabber(self, name: str, future: Future):
+        if future in self._abandoned:
+            del self._abandoned[future]
+            logging.warning(f"Abandoned run of grabber {name} finished after all.")
+            if name not in self._workers:
+                self._scheduler.complete(name, monotonic(), self._get_interval(name), failed=True)
+            return
+        del self._running[name]
+        # Slow runs back off like failed ones
+        failed = future.exception() is not None or name in self._timed_out
+        self._timed_out.discard(name)
+        if not failed:
+            self._last_success[name] = time()
+        interval = self._scheduler.complete(name, monotonic(), self._get_interval(name),
+                                            changed=not failed and future.result(), failed=failed)
+        self.metrics.set("auto_news_grabber_interval_seconds", interval, grabber=name)
+
+    def _get_interval(self, name: str) -> int:
+        if name in self._workers:
+            interval = self._workers[name].interval
+        else:
+            grabber = self._grabbers.get(name)
+            interval = None if grabber is None else grabber.get_interval()
+        # A grabber failing before its first run has no interval yet
+        return 3600 if interval is None else interval
+
+    def _run_grabber(self, name: str) -> bool:
+        self.metrics.bind_grabber(name)
+        start = perf_counter()
+        try:
+            worker = self._workers.get(name)
+            changed = bool(worker.tick(self) if worker is not None else self._get_grabber(name).tick())
+        except Exception as exception:
+            # Refetch in full next time, the response wasn't handled
+            self.http_client.discard_validators()
+            self.metrics.inc_grabber("auto_news_grabber_errors_total")
+            logging.exception(exception)
+            raise
+        finally:
+            self.metrics.observe_phase("total", perf_counter() - start)
+            self.metrics.bind_grabber(None)
+        self.http_client.commit_validators()
+        return changed
+
+    def _update_connection_metrics(self):
+        connection_stats = self.http_client.get_connection_stats()
+        logging.debug("Connection stats: %s", connection_stats)
+        for host, host_stats in connection_stats.items():
+            self.metrics.set("auto_news_http_requests", host_stats["requests"], host=host)
+            self.metrics.set("auto_news_http_connections", host_stats["connections"], host=host)
+        self.metrics.set("auto_news_fetch_cache_bytes", self.http_client.fetch_cache_size)
+
+    def _on_stall(self):
+        # WATCHDOG_EXIT=TRUE lets a restart policy replace a wedged instance, the state is only behind by one tick
+        if self._exit_on_stall:
+            logging.error("Exiting so the instance gets restarted.")
+            self._log_listener.stop()
+            os._exit(1)
+
+    def _health(self, readiness: bool) -> tuple[int, str, str]:
+        # GET /health fails when a restart would help, GET /ready also until this instance runs grabbers
+        now = time()
+        problems = []
+        if self._watchdog.stalled_for > 0:
+            problems.append(f"ticker stalled for {self._watchdog.stalled_for:.0f}s")
+        abandoned = list(self._abandoned.values())
+        if len(abandoned) > 0:
+            problems.append(f"stuck grabber thread(s) of {', '.join(abandoned)}")
+        if self._flush_failing_since is not None and now - self._flush_failing_since > self._watchdog.timeout:
+            problems.append(f"state flush failing for {now - self._flush_failing_since:.0f}s")
+        if readiness and not self._ticking:
+            problems.append("not started")
+        if readiness and self._coordinator is not None and not self._coordinator.registered:
+            problems.append("not registered with the coordination store")
+        running = self._running.copy()
+        grabbers = {}
+        for name in self._grabber_classes:
+            last_success = self._last_success.get(name)
+            grabbers[name] = {
+                "last_success": last_success,
+                "last_success_age": None if last_success is None else round(now - last_success, 1),
+                "running_for": round(monotonic() - running[name][0], 1) if name in running else None
+            }
+        return 200 if len(problems) == 0 else 503, "application/json", encode({
+            "status": "ok" if len(problems) == 0 else "failing",
+            "problems": problems,
+            "state_flush_age": round(now - self._last_flush, 1),
+            "queues": {
+                "delivery": self._delivery_queue.pending_count,
+                "events": self._event_store.pending_count,
+                "running": len(running),
+                "abandoned": len(abandoned)
+            },
+            "grabbers": grabbers
+        })
+
+    def emit_event(self, event_type: str, data: dict, tenant: str = None):
+        self._event_store.add({"time": time(), "type": event_type, "tenant": tenant, "grabber": self.metrics.grabber,
+                               "data": data})
+        self.metrics.inc("auto_news_events_total", type=event_type)
+
+    def create_news(self, message_content: str, news_content: str, webhook_urls: list = None):
+        if self._coordinator is not None:
+            # Instances racing during a handover create the same news
+            key = blake2b(encode([self.metrics.grabber, message_content, news_content, webhook_urls]).encode(),
+                          digest_size=16).hexdigest()
+            if not self._coordinator.claim_news(key):
+                logging.warning(f"Skipped duplicate news of another instance: {message_content}")
+                self.metrics.inc_grabber("auto_news_grabber_duplicate_news_total")
+                return
         # Send webhook
         logging.info(f"News created: {message_content}")
-        for webhook in self._webhooks:
-            webhook.send(message_content, news_content)
+        self.metrics.inc_grabber("auto_news_grabber_news_total")
+        self._delivery_queue.submit(message_content, news_content, webhook_urls)
+
+
+def setup_logging(level: int, file_name: str = "auto_news.log") -> QueueListener:
+    formatter = logging.Formatter("(%(asctime)s) [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S", "%")
+    # History is kept across restarts
+    file_handler = RotatingFileHandler(file_name, maxBytes=10 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.addFilter(LevelRangeLoggingFilter(logging.DEBUG, logging.INFO))
+    stream_handler.setFormatter(formatter)
+    error_handler = logging.StreamHandler(sys.stderr)
+    error_handler.addFilter(LevelRangeLoggingFilter(logging.WARNING, logging.CRITICAL))
+    error_handler.setFormatter(formatter)
+
+    # Grabber and ticker threads only enqueue records, disk and console are written by the listener thread
+    log_queue = SimpleQueue()
+    logging.root.setLevel(level)
+    logging.root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, stream_handler, error_handler, respect_handler_level=True)
+    listener.start()
+    return listener
 
 
 class LevelRangeLoggingFilter(logging.Filter):
@@ -105,22 +394,25 @@ class LevelRangeLoggingFilter(logging.Filter):
         return self._min <= record.levelno <= self._max
 
 
-class UpdateChecker(ABC):
-
-    def __init__(self, service: AutoNewsService):
-        self.service = service
-
-    @abstractmethod
-    def get_interval(self) -> int:
-        pass
-
-    @abstractmethod
-    def tick(self) -> None:
-        pass
-
-
 def main():
-    AutoNewsService()
+    argument_parser = argparse.ArgumentParser(description="Grabs LabyMod news and posts them to discord.")
+    argument_parser.add_argument("--record", metavar="ARCHIVE", help="Store every fetched payload in this archive.")
+    argument_parser.add_argument("--replay", metavar="ARCHIVE",
+                                 help="Run the grabbers over an archive as fast as possible. News are written to "
+                                      "a file instead of posted.")
+    argument_parser.add_argument("--output", default="./replay_news.jsonl",
+                                 help="Json lines file for the replayed news.")
+    arguments = argument_parser.parse_args()
+    if arguments.replay is None:
+        AutoNewsService(arguments.record)
+        return
+
+    load_dotenv()
+    log_listener = setup_logging(logging.DEBUG if os.getenv("DEBUG") == "TRUE" else logging.INFO, "replay.log")
+    try:
+        run_replay(arguments.replay, arguments.output)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+import logging
+import os
+import socket
+import sqlite3
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from threading import Event, Lock, Thread
+from time import time
+from uuid import uuid4
+
+from metrics import Metrics
+
+
+class CoordinationStore(ABC):
+    # Shared by all instances, implementations have to be safe across processes
+
+    @abstractmethod
+    def heartbeat(self, instance_id: str, now: float) -> None:
+        pass
+
+    @abstractmethod
+    def live_instances(self, since: float) -> list[str]:
+        pass
+
+    @abstractmethod
+    def remove_instance(self, instance_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def claim_key(self, key: str, instance_id: str, now: float, expires_before: float) -> bool:
+        # Returns False if another claim of the key is newer than expires_before
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteCoordinationStore(CoordinationStore):
+    # Works for instances on one host or a shared volume with working file locks
+
+    def __init__(self, path: str):
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS instances (id TEXT PRIMARY KEY, "
+                                     "heartbeat REAL NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, "
+                                     "instance TEXT NOT NULL, created REAL NOT NULL)")
+
+    def heartbeat(self, instance_id: str, now: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO instances (id, heartbeat) VALUES (?, ?)",
+                                     (instance_id, now))
+
+    def live_instances(self, since: float) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT id FROM instances WHERE heartbeat >= ?",
+                                                               (since,))]
+
+    def remove_instance(self, instance_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM instances WHERE id = ?", (instance_id,))
+
+    def claim_key(self, key: str, instance_id: str, now: float, expires_before: float) -> bool:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM idempotency_keys WHERE created < ?", (expires_before,))
+            cursor = self._connection.execute("INSERT OR IGNORE INTO idempotency_keys (key, instance, created) "
+                                              "VALUES (?, ?, ?)", (key, instance_id, now))
+            return cursor.rowcount == 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class Coordinator:
+    # Grabbers are sharded over the instances with a live heartbeat by rendezvous hashing, so every instance
+    # agrees on the owner without talking to the others and only the grabbers of a stopped instance move
+
+    def __init__(self, store: CoordinationStore, instance_id: str, metrics: Metrics = None):
+        self._store = store
+        self.instance_id = instance_id
+        self._metrics = metrics if metrics is not None else Metrics()
+        self.heartbeat_interval = float(os.getenv("COORDINATION_HEARTBEAT", "10"))
+        self._ttl = float(os.getenv("COORDINATION_TTL", "30"))
+        # Only instances racing over a handover create the same news, the race is over once the heartbeat of the
+        # previous owner expired. Longer windows would hide real repeats like a staff member rejoining
+        self._dedup_window = float(os.getenv("NEWS_DEDUP_WINDOW", str(3 * self._ttl)))
+        self._lock = Lock()
+        self._stopped = Event()
+        self._live = []
+        self._heartbeat()
+        self._thread = Thread(target=self._run, name="coordination-heartbeat", daemon=True)
+        self._thread.start()
+        logging.info(f"Coordinator: Started as {instance_id} with {len(self._live)} live instance(s).")
+
+    def _run(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            self._heartbeat()
+
+    def _heartbeat(self):
+        now = time()
+        try:
+            self._store.heartbeat(self.instance_id, now)
+            live = sorted(self._store.live_instances(now - self._ttl))
+        except Exception as exception:
+            # The others stop seeing us, so we give up every grabber rather than run them twice
+            logging.error(f"Coordinator: Heartbeat failed, releasing all grabbers: {exception}")
+            live = []
+        with self._lock:
+            if live != self._live:
+                logging.info(f"Coordinator: Live instances changed to {', '.join(live) or 'none'}.")
+            self._live = live
+        self._metrics.set("auto_news_coordination_instances", len(live))
+
+    @property
+    def registered(self) -> bool:
+        # False while the heartbeat fails, nothing is owned then
+        with self._lock:
+            return self.instance_id in self._live
+
+    def owns(self, grabber_name: str) -> bool:
+        with self._lock:
+            live = self._live
+        if len(live) == 0:
+            return False
+        return max(live, key=lambda instance_id: blake2b(f"{instance_id}/{grabber_name}".encode(),
+                                                         digest_size=8).digest()) == self.instance_id
+
+    def claim_news(self, key: str) -> bool:
+        # Returns False if an instance already created the news
+        now = time()
+        try:
+            return self._store.claim_key(key, self.instance_id, now, now - self._dedup_window)
+        except Exception as exception:
+            # Rather post twice than lose a news
+            logging.error(f"Coordinator: Couldn't claim news {key}: {exception}")
+            return True
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+        try:
+            # Others take over right away instead of waiting for the heartbeat to expire
+            self._store.remove_instance(self.instance_id)
+        except Exception as exception:
+            logging.error(f"Coordinator: Couldn't deregister: {exception}")
+        self._store.close()
+
+
+# Store factories by COORDINATION_BACKEND, other backends are registered here
+STORE_BACKENDS = {
+    "sqlite": lambda: SqliteCoordinationStore(os.getenv("COORDINATION_PATH", "./coordination.db"))
+}
+
+
+def create_coordinator(metrics: Metrics = None) -> Coordinator | None:
+    backend = os.getenv("COORDINATION_BACKEND")
+    if backend is None:
+        return None
+    if backend.lower() not in STORE_BACKENDS:
+        raise ValueError(f"Unknown coordination backend {backend}.")
+    instance_id = os.getenv("INSTANCE_ID", f"{socket.gethostname()}-{uuid4().hex[:8]}")
+    return Coordinator(STORE_BACKENDS[backend.lower()](), instance_id, metrics)
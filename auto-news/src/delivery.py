@@ -0,0 +1,240 @@
+import logging
+import os
+from json import loads as json_loads
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from uuid import uuid4
+
+from requests import RequestException, Response
+
+from discord_implementation import Webhook
+from metrics import Metrics
+from persistence import encode, write_atomic
+
+
+class DeliveryQueue:
+
+    def __init__(self, webhooks: list[Webhook], path: str = "./pending_news.json", metrics: Metrics = None):
+        self._path = path
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._lock = Lock()
+        self._stopped = Event()
+        self._max_attempts = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+        queue_size = int(os.getenv("DELIVERY_QUEUE_SIZE", "100"))
+        # News of a burst are sent as one digest, 1 item sends every news on its own
+        self._digest_window = float(os.getenv("DIGEST_WINDOW", "5"))
+        self._digest_max_items = int(os.getenv("DIGEST_MAX_ITEMS", "25"))
+        # Undelivered messages by id, persisted so they survive a restart
+        self._pending = {}
+        # Webhooks are labeled by index in metrics, the url contains the token
+        self._senders = {webhook.url: _WebhookSender(self, webhook, str(index), queue_size)
+                         for index, webhook in enumerate(webhooks)}
+        self._load()
+        for sender in self._senders.values():
+            sender.start()
+
+    def _load(self):
+        try:
+            with open(self._path, "r", encoding="UTF-8") as file_in:
+                pending = json_loads(file_in.read())
+        except FileNotFoundError:
+            return
+        for delivery_id, delivery in pending.items():
+            sender = self._senders.get(delivery["webhook"])
+            if sender is None:
+                logging.warning(f"DeliveryQueue: Dropping pending message {delivery_id} for an unknown webhook.")
+                continue
+            self._pending[delivery_id] = delivery
+            sender.enqueue(delivery_id)
+        logging.info(f"DeliveryQueue: Loaded {len(self._pending)} pending message(s).")
+        self._persist()
+
+    def submit(self, content: str, news: str = None, webhook_urls: list = None):
+        # All webhooks if none are given
+        for sender in self._senders.values() if webhook_urls is None else \
+                [self._senders[url] for url in webhook_urls if url in self._senders]:
+            delivery_id = uuid4().hex
+            with self._lock:
+                self._pending[delivery_id] = {
+                    "webhook": sender.webhook.url,
+                    "content": content,
+                    "news": news,
+                    "attempts": 0,
+                    "created": time()
+                }
+            self._persist()
+            sender.enqueue(delivery_id)
+
+    def get_delivery(self, delivery_id: str) -> dict | None:
+        with self._lock:
+            return self._pending.get(delivery_id)
+
+    def record_attempt(self, delivery_id: str) -> int:
+        with self._lock:
+            self._pending[delivery_id]["attempts"] += 1
+            return self._pending[delivery_id]["attempts"]
+
+    def complete(self, *delivery_ids: str):
+        with self._lock:
+            for delivery_id in delivery_ids:
+                self._pending.pop(delivery_id, None)
+        self._persist()
+
+    def _persist(self):
+        with self._lock:
+            try:
+                write_atomic(self._path, encode(self._pending))
+            except OSError as exception:
+                logging.exception(exception)
+
+    @property
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def max_attempts(self) -> int:
+        return self._max_attempts
+
+    @property
+    def digest_window(self) -> float:
+        return self._digest_window
+
+    @property
+    def digest_max_items(self) -> int:
+        return self._digest_max_items
+
+    @property
+    def stopped(self) -> Event:
+        return self._stopped
+
+    def close(self):
+        self._stopped.set()
+        for sender in self._senders.values():
+            sender.join(timeout=5)
+
+
+class _WebhookSender(Thread):
+
+    def __init__(self, delivery_queue: DeliveryQueue, webhook: Webhook, label: str, queue_size: int):
+        super().__init__(name=f"webhook-sender-{label}", daemon=True)
+        self._delivery_queue = delivery_queue
+        self.webhook = webhook
+        self._label = label
+        self._queue = Queue(maxsize=queue_size)
+        # Monotonic time until which discord asked us to wait
+        self._blocked_until = 0.0
+
+    def enqueue(self, delivery_id: str):
+        try:
+            self._queue.put(delivery_id, timeout=10)
+        except Full:
+            logging.error(f"DeliveryQueue: Queue full, message {delivery_id} stays pending until restart.")
+
+    def run(self):
+        # Queued ids not sent yet, in order
+        backlog = []
+        while not self._delivery_queue.stopped.is_set():
+            if len(backlog) == 0:
+                try:
+                    backlog.append(self._queue.get(timeout=1))
+                except Empty:
+                    continue
+            first = self._delivery_queue.get_delivery(backlog[0])
+            if first is None:
+                backlog.pop(0)
+                continue
+            # Waits for the rest of the burst, a backlog from a rate limit is older and goes out right away
+            self._wait(first.get("created", 0) + self._delivery_queue.digest_window - time())
+            self._wait(self._blocked_until - monotonic())
+            while True:
+                try:
+                    backlog.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            delivery_ids, payload = self._build_digest(backlog)
+            del backlog[:len(delivery_ids)]
+            self._deliver(delivery_ids, payload)
+
+    def _build_digest(self, backlog: list) -> tuple[list, dict]:
+        deliveries = [(delivery_id, self._delivery_queue.get_delivery(delivery_id))
+                      for delivery_id in backlog[:self._delivery_queue.digest_max_items]]
+        # Pending messages from before digests already have their payload
+        if "payload" in deliveries[0][1]:
+            return [deliveries[0][0]], deliveries[0][1]["payload"]
+        items = []
+        for delivery_id, delivery in deliveries:
+            if delivery is None or "payload" in delivery:
+                break
+            items.append((delivery["content"], delivery["news"]))
+        payload, item_count = self.webhook.build_digest_payload(items)
+        self._delivery_queue.metrics.observe("auto_news_webhook_digest_items", item_count, webhook=self._label)
+        return [delivery_id for delivery_id, _ in deliveries[:item_count]], payload
+
+    def _deliver(self, delivery_ids: list, payload: dict):
+        deliveries = [self._delivery_queue.get_delivery(delivery_id) for delivery_id in delivery_ids]
+        description = delivery_ids[0] if len(delivery_ids) == 1 else f"{delivery_ids[0]} (+{len(delivery_ids) - 1})"
+        # Retried in place to keep the order of messages
+        while not self._delivery_queue.stopped.is_set():
+            self._wait(self._blocked_until - monotonic())
+            attempts = max(self._delivery_queue.record_attempt(delivery_id) for delivery_id in delivery_ids)
+            metrics = self._delivery_queue.metrics
+            try:
+                with metrics.time("auto_news_webhook_post_seconds", webhook=self._label):
+                    response = self.webhook.post(payload)
+            except RequestException as exception:
+                metrics.inc("auto_news_webhook_failures_total", webhook=self._label, reason="connection")
+                logging.warning(f"DeliveryQueue: Sending {description} failed: {exception}")
+            else:
+                self._update_rate_limit(response)
+                if response.status_code == 429:
+                    metrics.inc("auto_news_webhook_rate_limited_total", webhook=self._label)
+                    logging.warning(f"DeliveryQueue: Rate limited, retrying {description} in "
+                                    f"{self._blocked_until - monotonic():.1f}s.")
+                    continue
+                if response.ok:
+                    for delivery in deliveries:
+                        if "created" in delivery:
+                            metrics.observe("auto_news_webhook_delivery_seconds", time() - delivery["created"],
+                                            webhook=self._label)
+                    self._delivery_queue.complete(*delivery_ids)
+                    return
+                metrics.inc("auto_news_webhook_failures_total", webhook=self._label, reason=str(response.status_code))
+                if response.status_code < 500 and len(delivery_ids) > 1:
+                    # One bad item shouldn't take the rest of the digest with it
+                    logging.warning(f"DeliveryQueue: Discord rejected {description} with {response.status_code}, "
+                                    f"sending its items one by one.")
+                    for delivery_id, delivery in zip(delivery_ids, deliveries):
+                        self._deliver([delivery_id], self.webhook.build_payload(delivery["content"],
+                                                                                delivery["news"]))
+                    return
+                if response.status_code < 500:
+                    logging.error(f"DeliveryQueue: Discord rejected {description} with {response.status_code}: "
+                                  f"{response.text}")
+                    self._delivery_queue.complete(*delivery_ids)
+                    return
+                logging.warning(f"DeliveryQueue: Sending {description} failed with {response.status_code}.")
+
+            if attempts >= self._delivery_queue.max_attempts:
+                logging.error(f"DeliveryQueue: Giving up on {description} after {attempts} attempt(s).")
+                self._delivery_queue.complete(*delivery_ids)
+                return
+            self._wait(2 ** attempts)
+
+    def _update_rate_limit(self, response: Response):
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is None:
+                try:
+                    retry_after = response.json().get("retry_after")
+                except ValueError:
+                    pass
+            self._blocked_until = monotonic() + float(retry_after or 1)
+            return
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            self._blocked_until = monotonic() + float(response.headers.get("X-RateLimit-Reset-After", "1"))
+
+    def _wait(self, seconds: float):
+        if seconds > 0:
+            self._delivery_queue.stopped.wait(seconds)
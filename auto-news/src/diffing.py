@@ -0,0 +1,28 @@
+from typing import Callable, Iterable, NamedTuple
+
+
+class Diff(NamedTuple):
+    # Keys keep the order of the state they come from
+    added: dict
+    removed: dict
+    changed: dict
+
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.changed) == 0
+
+
+def diff_keyed(old: dict, new: dict, compare: Callable = None) -> Diff:
+    # Linear time, every lookup goes against a dict
+    if compare is None:
+        def compare(value):
+            return value
+
+    added = {key: value for key, value in new.items() if key not in old}
+    removed = {key: value for key, value in old.items() if key not in new}
+    changed = {key: (old[key], value) for key, value in new.items()
+               if key in old and compare(old[key]) != compare(value)}
+    return Diff(added, removed, changed)
+
+
+def diff_items(old: Iterable, new: Iterable) -> Diff:
+    return diff_keyed(dict.fromkeys(old), dict.fromkeys(new))
@@ -1,36 +1,97 @@
-from requests import post
+from requests import Response
+
+from http_client import HttpClient
+
+# Discord limits for a webhook message
+MAX_CONTENT_LENGTH = 2000
+BUTTONS_PER_ROW = 5
+MAX_BUTTONS = 25
+MAX_BUTTON_URL_LENGTH = 512
 
 
 class Webhook:
 
-    def __init__(self, url: str, target_role_id: int = None):
+    def __init__(self, url: str, http_client: HttpClient, target_role_id: int = None):
         self._url = url
+        self._http_client = http_client
         self._target_role = target_role_id
 
-    def send(self, content: str = "", news: str = None):
+    @property
+    def url(self) -> str:
+        return self._url
+
+    def send(self, content: str = "", news: str = None) -> Response:
+        return self.post(self.build_payload(content, news))
+
+    def build_payload(self, content: str = "", news: str = None) -> dict:
+        return self.build_digest_payload([(content, news)])[0]
+
+    def build_digest_payload(self, items: list) -> tuple[dict, int]:
+        # Packs as many (content, news) items from the start as discord allows into one message and returns it with
+        # the number of items it holds, an item too long on its own is shortened and sent alone
+        prefix = "" if self._target_role is None else f"<@&{self._target_role}>\n"
+        texts = []
+        tweets = []
+        length = len(prefix)
+        for content, news in items:
+            has_news = news is not None and news != ""
+            text = _shorten_text(content, news if has_news else None, MAX_CONTENT_LENGTH - len(prefix))
+            # Counts the separator and the number the item may get
+            added_length = len(text) + (2 if len(texts) > 0 else 0) + \
+                (len(f"**[{len(tweets) + 1}]** ") if has_news else 0)
+            if len(texts) > 0 and (length + added_length > MAX_CONTENT_LENGTH or
+                                   has_news and len(tweets) == MAX_BUTTONS):
+                break
+            texts.append(text)
+            if has_news:
+                tweets.append((len(texts) - 1, news))
+            length += added_length
+
+        # Items get numbered to match their button once there is more than one
+        if len(tweets) > 1:
+            for number, (index, _) in enumerate(tweets, 1):
+                texts[index] = f"**[{number}]** {texts[index]}"
         json_payload = {
-            "content": f"{content}",
+            "content": prefix + "\n\n".join(texts),
             "tts": False,
         }
-
-        if news is not None and news != "":
-            json_payload["content"] += f"\n\n```{news}```"
-            news = news.replace("\n", "%0A").replace(" ", "%20")
-            json_payload["components"] = [{
-                "type": 1,
-                "components": [{
-                    "type": 2,
-                    "style": 5,
-                    "label": "Direct Tweet (Admin only)",
-                    "url": f"https://twitter.com/intent/tweet?text={news}"
-                }]
-            }]
+        if len(tweets) > 0:
+            buttons = [{
+                "type": 2,
+                "style": 5,
+                "label": "Direct Tweet (Admin only)" if len(tweets) == 1 else f"Direct Tweet {number} (Admin only)",
+                "url": _tweet_url(news)
+            } for number, (_, news) in enumerate(tweets, 1)]
+            json_payload["components"] = [{"type": 1, "components": buttons[start:start + BUTTONS_PER_ROW]}
+                                          for start in range(0, len(buttons), BUTTONS_PER_ROW)]
 
         # Add allowed mentions if not none
         if self._target_role is not None:
-            json_payload["content"] = f"<@&{self._target_role}>\n" + json_payload["content"]
             json_payload["allowed_mentions"] = {
                 "roles": [f"{self._target_role}"]
             }
 
-        post(self._url, json=json_payload)
+        return json_payload, len(texts)
+
+    def post(self, json_payload: dict) -> Response:
+        return self._http_client.post(self._url, json=json_payload)
+
+
+def _shorten_text(content: str, news: str | None, limit: int) -> str:
+    text = f"{content}\n\n```{news}```" if news is not None else f"{content}"
+    if len(text) <= limit:
+        return text
+    # The news is cut inside its code block as long as the content fits
+    if news is not None and len(content) + 9 < limit:
+        return f"{content}\n\n```{news[:limit - len(content) - 9]}…```"
+    return content[:limit - 1] + "…"
+
+
+def _tweet_url(news: str) -> str:
+    url = "https://twitter.com/intent/tweet?text=" + news.replace("\n", "%0A").replace(" ", "%20")
+    if len(url) <= MAX_BUTTON_URL_LENGTH:
+        return url
+    # Longer than a tweet anyway, cut without splitting an escape
+    url = url[:MAX_BUTTON_URL_LENGTH]
+    escape = url.rfind("%", len(url) - 2)
+    return url if escape == -1 else url[:escape]
@@ -0,0 +1,140 @@
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime
+from json import loads as json_loads
+from threading import Lock
+
+from persistence import encode
+
+# Event types emitted by the built-in grabbers, with the fields of their data:
+# version.published (channel, version, previous_version)
+# staff.joined, staff.left (uuid, name, rank), staff.rank_changed (uuid, name, rank, previous_rank)
+# shop.item_added (id, name), shop.item_removed (id), shop.category_added, shop.category_removed (category),
+# shop.event_started (event, previous_event), banner.added, banner.removed (text)
+# advertisement.added, advertisement.removed (title)
+
+
+class EventStore(ABC):
+    # Append only, events are buffered and written in one go with the state
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = []
+
+    def add(self, event: dict) -> None:
+        with self._lock:
+            self._pending.append(event)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> None:
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            events = self._pending
+            self._pending = []
+        try:
+            self._append(events)
+        except Exception:
+            with self._lock:
+                self._pending[:0] = events
+            raise
+        logging.debug("EventStore: Appended %s event(s).", len(events))
+
+    @abstractmethod
+    def _append(self, events: list[dict]) -> None:
+        pass
+
+    @abstractmethod
+    def query(self, types: list[str] = None, since: float = None, until: float = None, tenant: str = None,
+              after: int = 0, limit: int = 100) -> list[dict]:
+        # Ordered by id, a type also matches its subtypes like staff for staff.joined
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SqliteEventStore(EventStore):
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._connection_lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                     "time REAL NOT NULL, type TEXT NOT NULL, tenant TEXT, grabber TEXT, "
+                                     "data TEXT NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS events_type ON events (type, id)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS events_time ON events (time)")
+
+    def _append(self, events: list[dict]) -> None:
+        with self._connection_lock, self._connection:
+            self._connection.executemany("INSERT INTO events (time, type, tenant, grabber, data) "
+                                         "VALUES (?, ?, ?, ?, ?)",
+                                         [(event["time"], event["type"], event["tenant"], event["grabber"],
+                                           encode(event["data"])) for event in events])
+
+    def query(self, types: list[str] = None, since: float = None, until: float = None, tenant: str = None,
+              after: int = 0, limit: int = 100) -> list[dict]:
+        conditions = ["id > ?"]
+        parameters = [after]
+        if types:
+            conditions.append("(" + " OR ".join("type = ? OR type LIKE ?" for _ in types) + ")")
+            for event_type in types:
+                parameters += [event_type, f"{event_type}.%"]
+        if since is not None:
+            conditions.append("time >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("time < ?")
+            parameters.append(until)
+        if tenant is not None:
+            conditions.append("tenant = ?")
+            parameters.append(tenant)
+        with self._connection_lock:
+            rows = self._connection.execute(f"SELECT id, time, type, tenant, grabber, data FROM events WHERE "
+                                            f"{' AND '.join(conditions)} ORDER BY id LIMIT ?",
+                                            (*parameters, limit)).fetchall()
+        return [{"id": row[0], "time": row[1], "type": row[2], "tenant": row[3], "grabber": row[4],
+                 "data": json_loads(row[5])} for row in rows]
+
+    def close(self) -> None:
+        super().close()
+        with self._connection_lock:
+            self._connection.close()
+
+
+def create_event_store() -> EventStore:
+    return SqliteEventStore(os.getenv("EVENT_STORE_PATH", "./events.db"))
+
+
+def _parse_time(value: str | None) -> float | None:
+    # Unix seconds or ISO 8601
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def query_events(event_store: EventStore, query: dict) -> tuple[int, str, str]:
+    # GET /events?type=staff,shop.item_added&since=...&until=...&tenant=...&after=<next>&limit=100
+    try:
+        types = [event_type for event_type in query.get("type", "").split(",") if event_type != ""]
+        limit = min(max(int(query.get("limit", "100")), 1), 1000)
+        events = event_store.query(types, _parse_time(query.get("since")), _parse_time(query.get("until")),
+                                   query.get("tenant"), int(query.get("after", "0")), limit)
+    except ValueError as exception:
+        return 400, "application/json", encode({"error": str(exception)})
+    # Pages are full until the end, the next one starts after the last id
+    return 200, "application/json", encode({
+        "events": events,
+        "next": events[-1]["id"] if len(events) == limit else None
+    })
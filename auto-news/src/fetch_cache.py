@@ -0,0 +1,110 @@
+import logging
+import sys
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from requests import Response
+
+
+def estimate_size(value) -> int:
+    # Rough deep size of parsed json
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class FetchCacheEntry:
+    __slots__ = ("validators", "response", "chunks", "complete", "encoding", "parsed", "size", "fetched_at",
+                 "consumers")
+
+    def __init__(self, validators: dict | None, response: Response = None, chunks: list = None, complete: bool = True,
+                 encoding: str = None, consumer: str = None):
+        # Validators of the content, or the ones answered with a 304 if there is none
+        self.validators = validators
+        self.response = response
+        self.chunks = chunks
+        self.complete = complete
+        self.encoding = encoding
+        # Parsed results by kind, computed once per entry
+        self.parsed = {}
+        self.size = len(response.content) if response is not None else \
+            sum(len(chunk) for chunk in chunks) if chunks is not None else 0
+        self.fetched_at = monotonic()
+        # Grabbers which got this entry, their next request has to look for changes since
+        self.consumers = {consumer}
+
+
+class FetchCache:
+    # Responses by url with a ttl, lru eviction and a memory bound. Callers hold the url lock while fetching, so
+    # concurrent requests for the same url wait for the first download instead of starting their own. Within the ttl
+    # an entry is shared with other grabbers, but never served twice to the same one
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._url_locks = {}
+        self._size = 0
+
+    def lock(self, url: str) -> Lock:
+        with self._lock:
+            return self._url_locks.setdefault(url, Lock())
+
+    def get(self, url: str, requested_at: float, consumer: str = None) -> FetchCacheEntry | None:
+        # Entries fetched while the caller waited for the url lock are always used
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry.fetched_at < requested_at and monotonic() - entry.fetched_at > self._ttl:
+                self._remove(url)
+                return None
+            if entry.fetched_at < requested_at and consumer is not None and consumer in entry.consumers:
+                # A repoll, scheduled intervals can be shorter than the ttl
+                return None
+            entry.consumers.add(consumer)
+            self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url: str, entry: FetchCacheEntry):
+        with self._lock:
+            if url in self._entries:
+                self._remove(url)
+            self._entries[url] = entry
+            self._size += entry.size
+            self._evict()
+
+    def get_parsed(self, url: str, entry: FetchCacheEntry, kind: str, parse):
+        with self.lock(url):
+            if kind not in entry.parsed:
+                entry.parsed[kind] = parse()
+                with self._lock:
+                    parsed_size = estimate_size(entry.parsed[kind])
+                    entry.size += parsed_size
+                    if self._entries.get(url) is entry:
+                        self._size += parsed_size
+                        self._evict()
+            return entry.parsed[kind]
+
+    def _evict(self):
+        while len(self._entries) > self._max_entries or (self._size > self._max_bytes and len(self._entries) > 1):
+            url = next(iter(self._entries))
+            logging.debug("FetchCache: Evicting %s.", url)
+            self._remove(url)
+
+    def _remove(self, url: str):
+        self._size -= self._entries.pop(url).size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -1,35 +1,62 @@
 import logging
-import os
-from html.parser import HTMLParser
 
-from requests import get
-
-from auto_news import UpdateChecker
+from diffing import diff_items, diff_keyed
+from html_extraction import ExtractionParser, create_feeder
+from persistence import compact_ids, compact_staff, expand_staff
+from update_checker import UpdateChecker
 
 
 class VersionChecker(UpdateChecker):
     NEWS: str = "📥UPDATE:\n\nDie LabyMod Version {version} wurde veröffentlicht. Was es alles neues gibt, " \
                 "seht ihr hier: "
 
+    def __init__(self, service):
+        super().__init__(service)
+        self._channels = service.config["version_channels"]
+        logging.info(f"VersionChecker: Watching version channel(s) {', '.join(self._channels)}.")
+
     def get_interval(self) -> int:
-        return 5
+        return 300
 
-    def tick(self) -> None:
+    def tick(self) -> bool:
+        current_versions = {channel: self.get_state(self._get_save_key(channel))
+                            for channel in self._channels}
         # Check from versions.json to prevent unneeded html parsing
-        online_version = get("https://dl.labymod.net/versions.json").json()["1.8.9"]["version"]
+        versions_json = self.http_client.get_json_if_modified("https://dl.labymod.net/versions.json",
+                                                              None not in current_versions.values())
+        if versions_json is None:
+            logging.debug("VersionChecker: versions.json not modified.")
+            return False
+
+        # Channels usually get the same version, it's only announced once
+        announced_versions = set()
+        for channel, current_version in current_versions.items():
+            online_version = self.parse_version(versions_json, channel)
+            self.set_state(self._get_save_key(channel), online_version)
+            logging.debug("VersionChecker: Got %s and had %s for %s", online_version, current_version, channel)
+            if current_version is None:
+                logging.warning(f"VersionChecker: No current version found in data for {channel}.")
+                continue
+
+            if online_version != current_version:
+                self.emit_event("version.published", channel=channel, version=online_version,
+                                previous_version=current_version)
+            # Check news
+            if online_version != current_version and online_version not in announced_versions:
+                announced_versions.add(online_version)
+                # Add changelog later
+                self.service.create_news(f"New LabyMod version **{online_version}** published. Please check!",
+                                         self.NEWS.format(version=online_version))
+        return len(announced_versions) >= 1
 
-        current_version = self.service.get_from_save_data("labymod_version")
-        self.service.add_save_data("labymod_version", online_version)
-        logging.debug(f"VersionChecker: Got {online_version} and had {current_version}")
-        if current_version is None:
-            logging.warning("VersionChecker: No current version found in data.")
-            return
+    @staticmethod
+    def _get_save_key(channel: str) -> str:
+        # 1.8.9 keeps the key from before channels were configurable
+        return "labymod_version" if channel == "1.8.9" else f"labymod_version_{channel}"
 
-        # Check news
-        if online_version != current_version:
-            # Add changelog later
-            self.service.create_news(f"New LabyMod version **{online_version}** published. Please check!",
-                                     self.NEWS.format(version=online_version))
+    @staticmethod
+    def parse_version(versions_json: dict, channel: str = "1.8.9") -> str:
+        return versions_json[channel]["version"]
 
 
 class StaffChecker(UpdateChecker):
@@ -47,62 +74,75 @@ class StaffChecker(UpdateChecker):
 
     def __init__(self, service):
         super().__init__(service)
-        self._parser = self._BadgeMemberParser()
-        self._badge_uuid = os.getenv("STAFF_BADGE")
+        # Created on the first tick
+        self._parser = None
+        self._badge_uuid = service.config["staff_badge"]
         logging.info(f"StaffChecker: Loaded {self._badge_uuid} as staff badge.")
 
     def get_interval(self) -> int:
-        return 60
-
-    def tick(self) -> None:
-        # Feeding parser with badge website
+        return 3600
+
+    def tick(self) -> bool:
+        if self._parser is None:
+            self._parser = self._BadgeMemberParser()
+        try:
+            return self._check_staff()
+        finally:
+            # Nothing of the page is kept until the next tick
+            self._parser.reset()
+
+    def _check_staff(self) -> bool:
+        current_staff = self.get_state("labymod_staff")
+        # Feeding parser with badge website while it's downloaded
         logging.debug("StaffChecker: Start parsing html.")
-        self._parser.feed(get(f"https://laby.net/badge/{self._badge_uuid}").text)
+        if not self.http_client.stream_if_modified(f"https://laby.net/badge/{self._badge_uuid}",
+                                                   create_feeder(self._parser), current_staff is not None):
+            logging.debug("StaffChecker: Badge page not modified.")
+            return False
 
-        current_staff = self.service.get_from_save_data("labymod_staff")
-        self.service.add_save_data("labymod_staff", self._parser.stored_staff_members)
+        self.set_state("labymod_staff", compact_staff(self._parser.stored_staff_members))
         if current_staff is None:
             logging.warning("StaffChecker: No current staff data found.")
-            return
-
-        # Looping through to validate
-        logging.debug("StaffChecker: Started new checking")
-        for staff_uuid, staff_data in self._parser.stored_staff_members.items():
-            if staff_uuid not in current_staff:
-                self.service.create_news(self.NEW_STAFF_MEMBER[0].format(name=staff_data["name"],
-                                                                         rank=staff_data["rank"]),
-                                         self.NEW_STAFF_MEMBER[1].format(name=staff_data["name"],
-                                                                         rank=staff_data["rank"]))
-                continue
-            old_rank = current_staff[staff_uuid]["rank"]
-            if staff_data["rank"] == old_rank:
-                logging.debug(f"StaffChecker: No change for {staff_uuid}")
-                continue
-            # Can only be new rank here - Checking for junior before
+            return False
+        # Stored with ranks by index
+        current_staff = expand_staff(current_staff)
+
+        with self.metrics.time_phase("diff"):
+            staff_diff = diff_keyed(current_staff, self._parser.stored_staff_members,
+                                    lambda staff_data: staff_data["rank"])
+        logging.debug("StaffChecker: %s joined, %s changed and %s left.", len(staff_diff.added),
+                      len(staff_diff.changed), len(staff_diff.removed))
+        for uuid, staff_data in staff_diff.added.items():
+            self.emit_event("staff.joined", uuid=uuid, name=staff_data["name"], rank=staff_data["rank"])
+            self.service.create_news(self.NEW_STAFF_MEMBER[0].format(name=staff_data["name"], rank=staff_data["rank"]),
+                                     self.NEW_STAFF_MEMBER[1].format(name=staff_data["name"], rank=staff_data["rank"]))
+
+        for uuid, (old_data, staff_data) in staff_diff.changed.items():
+            old_rank = old_data["rank"]
+            self.emit_event("staff.rank_changed", uuid=uuid, name=staff_data["name"], rank=staff_data["rank"],
+                            previous_rank=old_rank)
+            # Checking for junior before
             change_message = self.NEW_RANK_PASSED if old_rank.startswith("Jr ") and old_rank[3:] == staff_data["rank"] \
                 else self.NEW_RANK
             # Create news
             self.service.create_news(change_message[0].format(name=staff_data["name"], rank=staff_data["rank"]),
                                      change_message[1].format(name=staff_data["name"], rank=staff_data["rank"]))
 
-        # Looping trough old to get leaves
-        logging.debug("StaffChecker: Started old checking")
-        for staff_uuid, staff_data in current_staff.items():
-            if staff_uuid not in self._parser.stored_staff_members:
-                self.service.create_news(self.STAFF_LEAVE[0].format(name=staff_data["name"],
-                                                                    rank=staff_data["rank"]),
-                                         self.STAFF_LEAVE[1].format(name=staff_data["name"],
-                                                                    rank=staff_data["rank"]))
-                continue
-            logging.debug(f"StaffChecker: {staff_uuid} is still in team.")
+        for uuid, staff_data in staff_diff.removed.items():
+            self.emit_event("staff.left", uuid=uuid, name=staff_data["name"], rank=staff_data["rank"])
+            self.service.create_news(self.STAFF_LEAVE[0].format(name=staff_data["name"], rank=staff_data["rank"]),
+                                     self.STAFF_LEAVE[1].format(name=staff_data["name"], rank=staff_data["rank"]))
+        return not staff_diff.is_empty()
 
-    class _BadgeMemberParser(HTMLParser):
+    class _BadgeMemberParser(ExtractionParser):
 
-        def __init__(self):
-            super().__init__()
+        def reset(self):
+            # Called by the constructor and around every document
+            super().reset()
             self._storing_started_prepared = False
             self._storing_started = False
             self._last_uuid = None
+            self._name_parts = []
             self.stored_staff_members = {}
 
         def handle_starttag(self, tag, attributes):
@@ -121,7 +161,7 @@ class StaffChecker(UpdateChecker):
             if tag != "a" or not self._storing_started or len(attributes) < 3:
                 return
 
-            logging.debug(f"StaffChecker: Found a tag with {attributes}")
+            logging.debug("StaffChecker: Found a tag with %s", attributes)
             rank = None
             for attribute_name, value in attributes:
                 if attribute_name == "href":
@@ -135,109 +175,159 @@ class StaffChecker(UpdateChecker):
                 logging.debug("No rank found.")
                 return
 
-            logging.debug(f"StaffChecker: Saved {self._last_uuid} with {rank}")
+            logging.debug("StaffChecker: Saved %s with %s", self._last_uuid, rank)
             self.stored_staff_members[self._last_uuid] = {
                 "rank": rank
             }
 
         def handle_data(self, data):
             if self._storing_started and self._last_uuid is not None and data.replace("\n", "").strip() != "":
-                logging.debug(f"StaffChecker: Found {data} for {self._last_uuid}")
-                self.stored_staff_members[self._last_uuid]["name"] = data
+                logging.debug("StaffChecker: Found %s for %s", data, self._last_uuid)
+                # Text can arrive split across stream chunks
+                self._name_parts.append(data)
 
         def handle_endtag(self, tag):
-            if tag != "a" and self._storing_started:
+            if tag == "a":
+                # Only text inside the link is the name
+                if self._last_uuid in self.stored_staff_members and len(self._name_parts) > 0:
+                    self.stored_staff_members[self._last_uuid]["name"] = "".join(self._name_parts)
+                self._last_uuid = None
+                self._name_parts = []
+                return
+            if self._storing_started:
                 logging.debug("StaffChecker: Ended parsing.")
                 self._storing_started = False
                 self._storing_started_prepared = False
+                # The users list is the only part needed
+                self.done = True
 
 
 class ShopChecker(UpdateChecker):
 
     def __init__(self, service):
         super().__init__(service)
-        self._parser = self._ShopItemParser()
+        # Created on the first tick
+        self._parser = None
+        # Shop event of the last parsed page, the parser doesn't keep it between ticks
+        self._event = None
 
     def get_interval(self) -> int:
-        return 60
+        # Events bring new items and banners
+        return 3600 if self._event is None else 1200
 
-    def _check_banner(self) -> None:
-        current_banners: list = self.service.get_from_save_data("top_banner")
+    def _check_banner(self) -> bool:
+        current_banners: list = self.get_state("top_banner")
 
-        self.service.add_save_data("top_banner", self._parser.banners)
+        self.set_state("top_banner", self._parser.banners)
         if current_banners is None:
             logging.warning("ShopChecker (Banner): No current banner data found.")
-            return
-
-        new_banners = [banner for banner in self._parser.banners if banner not in current_banners]
-        if len(new_banners) >= 1:
-            self.service.create_news("**New event banners - Please check!**\n" + "\n".join(new_banners), "")
-
-    def tick(self) -> None:
-        # Getting shop and parse it to get items
+            return False
+
+        with self.metrics.time_phase("diff"):
+            banner_diff = diff_items(current_banners, self._parser.banners)
+        for banner in banner_diff.added:
+            self.emit_event("banner.added", text=banner)
+        for banner in banner_diff.removed:
+            self.emit_event("banner.removed", text=banner)
+        if len(banner_diff.added) >= 1:
+            self.service.create_news("**New event banners - Please check!**\n" + "\n".join(banner_diff.added), "")
+        if len(banner_diff.removed) >= 1:
+            self.service.create_news("**Removed event banners - Please check!**\n" + "\n".join(banner_diff.removed),
+                                     "")
+        return not banner_diff.is_empty()
+
+    def tick(self) -> bool:
+        if self._parser is None:
+            self._parser = self._ShopItemParser()
+        try:
+            return self._check_shop()
+        finally:
+            # Nothing of the page is kept until the next tick
+            self._parser.reset()
+
+    def _check_shop(self) -> bool:
+        current_shop = self.get_state("labymod_shop")
+        if current_shop is not None and self._event is None:
+            # Known event after a restart
+            self._event = current_shop.get("event")
+        # Getting shop and parse it while it's downloaded to get items
         logging.debug("ShopChecker: Start parsing html.")
-        self._parser.feed(get("https://labymod.net/shop").text)
+        if not self.http_client.stream_if_modified("https://labymod.net/shop", create_feeder(self._parser),
+                                                   current_shop is not None and
+                                                   self.get_state("top_banner") is not None):
+            logging.debug("ShopChecker: Shop page not modified.")
+            return False
+        self._event = self._parser.event
         # Checking for banner
         logging.info("ShopChecker (Banner): Started grabbing event banners.")
-        self._check_banner()
+        banner_changed = self._check_banner()
         # Filter shop items for emotes because it's not needed
         online_items = {item_id: item_data["name"] for item_id, item_data in self._parser.stored_items.items()
                         if item_data["category"] != "EMOTE"}
 
-        current_shop = self.service.get_from_save_data("labymod_shop")
-        self.service.add_save_data("labymod_shop", {
-            "items": [item_id for item_id in online_items],
+        self.set_state("labymod_shop", {
+            "items": compact_ids(online_items),
             "categories": self._parser.shop_categories,
             "event": self._parser.event
         })
         if current_shop is None:
             logging.warning("ShopChecker: No current shop data found.")
-            return
+            return False
 
         message_content = "Shop-Update - Please check!"
-        items_to_announce = [item_name for item_id, item_name in online_items.items()
-                             if item_id not in current_shop["items"]]
-        if len(items_to_announce) >= 1:
-            message_content += "\n**New shop items:** " + ", ".join(items_to_announce)
-        categories_to_announce = [category for category in self._parser.shop_categories
-                                  if category not in current_shop["categories"]]
-        if len(categories_to_announce) >= 1:
-            message_content += "\n**New categories/seasons:** " + ", ".join(categories_to_announce)
+        with self.metrics.time_phase("diff"):
+            # Only ids of the old items are stored, names are looked up in the online ones
+            item_diff = diff_items(current_shop["items"], online_items)
+            category_diff = diff_items(current_shop["categories"], self._parser.shop_categories)
+        for item_id in item_diff.added:
+            self.emit_event("shop.item_added", id=item_id, name=online_items[item_id])
+        for item_id in item_diff.removed:
+            self.emit_event("shop.item_removed", id=item_id)
+        for category in category_diff.added:
+            self.emit_event("shop.category_added", category=category)
+        for category in category_diff.removed:
+            self.emit_event("shop.category_removed", category=category)
+        if len(item_diff.added) >= 1:
+            message_content += "\n**New shop items:** " + ", ".join(online_items[item_id] for item_id in item_diff.added)
+        if len(item_diff.removed) >= 1:
+            message_content += "\n**Removed shop items (ids):** " + ", ".join(str(item_id)
+                                                                              for item_id in item_diff.removed)
+        if len(category_diff.added) >= 1:
+            message_content += "\n**New categories/seasons:** " + ", ".join(category_diff.added)
+        if len(category_diff.removed) >= 1:
+            message_content += "\n**Removed categories/seasons:** " + ", ".join(category_diff.removed)
 
         if self._parser.event is not None and "event" in current_shop and current_shop["event"] != self._parser.event:
+            self.emit_event("shop.event_started", event=self._parser.event, previous_event=current_shop["event"])
             message_content += f"\n**New shop event:** {self._parser.event}"
 
         if message_content != "Shop-Update - Please check!":
             self.service.create_news(message_content, "")
+            return True
+        return banner_changed
 
-    class _ShopItemParser(HTMLParser):
+    class _ShopItemParser(ExtractionParser):
 
-        def __init__(self):
-            super().__init__()
+        def reset(self):
+            # Called by the constructor and around every document
+            super().reset()
             self.shop_categories = []
             self.stored_items = {}
             self.banners = []
             self.event = None
+            # Text is collected in parts and joined once the element ends
+            self._banner_parts = None
+            self._event_parts = None
             self._banner_fetch = True
-            self._banner_fetch_currently = False
             self._started_category_fetch = False
-            self._started_event_fetch = False
             self._inner_event_container_count = 0
 
         def handle_starttag(self, tag, attributes):
-            if tag == "html":
-                logging.debug("ShopChecker: Clearing stored data.")
-                self.stored_items.clear()
-                self._banner_fetch = True
-                self.shop_categories.clear()
-                self.banners.clear()
-                return
-
             # Check for banner and event
             if tag == "div":
-                if self._started_event_fetch:
+                if self._event_parts is not None:
                     self._inner_event_container_count += 1
-                    logging.debug(f"ShopChecker: Increased inner event count to {self._inner_event_container_count}.")
+                    logging.debug("ShopChecker: Increased inner event count to %s.", self._inner_event_container_count)
                     return
 
                 if len(attributes) < 1 or attributes[0][0] != "class":
@@ -246,20 +336,19 @@ class ShopChecker(UpdateChecker):
                 match attributes[0][1]:
                     case "info-bar" if self._banner_fetch:
                         # Add new banner element
-                        self._banner_fetch_currently = True
+                        self._finish_banner()
                         logging.debug("ShopChecker (Banner): Found new event bar.")
-                        self.banners.append("")
+                        self._banner_parts = []
                         return
                     case "row lm-box event-box":
                         logging.debug("ShopChecker: Started event fetch. ")
-                        self.event = ""
-                        self._started_event_fetch = True
+                        self._event_parts = []
                         return
 
             # Check for header to disable banner
             if tag == "header":
                 logging.debug("ShopChecker (Banner): Finished banner parsing.")
-                self._banner_fetch_currently = False
+                self._finish_banner()
                 self._banner_fetch = False
                 return
 
@@ -270,14 +359,14 @@ class ShopChecker(UpdateChecker):
                 return
 
             if tag == "li" and self._started_category_fetch:
-                logging.debug(f"ShopChecker: Found category with {attributes[0]}")
+                logging.debug("ShopChecker: Found category with %s", attributes[0])
                 self.shop_categories.append(attributes[0][1].replace("active", "").strip())
                 return
 
             if tag != "article" or len(attributes) <= 4:
                 return
 
-            logging.debug(f"ShopChecker: Found a tag with {attributes}")
+            logging.debug("ShopChecker: Found a tag with %s", attributes)
             data: dict = {}
             date_id: int = -1
             for attribute_name, value in attributes:
@@ -296,10 +385,13 @@ class ShopChecker(UpdateChecker):
                 if attribute_name == "data-item-name":
                     data["name"] = value
             if date_id != -1:
-                logging.debug(f"ShopChecker: Found item {date_id} with {data}")
+                logging.debug("ShopChecker: Found item %s with %s", date_id, data)
                 self.stored_items[date_id] = data
 
         def handle_endtag(self, tag):
+            if tag == "body":
+                self.done = True
+                return
             if tag == "ul" and self._started_category_fetch:
                 logging.debug("ShopChecker: Finished category parsing.")
                 self._started_category_fetch = False
@@ -307,61 +399,83 @@ class ShopChecker(UpdateChecker):
             if tag != "div":
                 return
 
-            if self._banner_fetch and self._banner_fetch_currently:
+            if self._banner_fetch and self._banner_parts is not None:
                 logging.debug("ShopChecker (Banner): Finished an event banner.")
-                self._banner_fetch_currently = False
+                self._finish_banner()
                 return
 
-            if not self._started_event_fetch:
+            if self._event_parts is None:
                 return
 
             if self._inner_event_container_count == 0:
                 logging.debug("ShopChecker: Finished event fetch.")
-                self._started_event_fetch = False
+                self.event = "".join(self._event_parts)
+                self._event_parts = None
                 return
 
             self._inner_event_container_count -= 1
-            logging.debug(f"ShopChecker: Decreased inner event count to {self._inner_event_container_count}")
+            logging.debug("ShopChecker: Decreased inner event count to %s", self._inner_event_container_count)
 
         def handle_data(self, data):
             data = data.replace("\n", "")
-            if self._started_event_fetch:
-                logging.debug(f"ShopChecker: Added part to shop event {data}")
-                self.event += data
+            if self._event_parts is not None:
+                logging.debug("ShopChecker: Added part to shop event %s", data)
+                self._event_parts.append(data)
                 return
-            if self._banner_fetch and self._banner_fetch_currently:
-                logging.debug(f"ShopChecker (Banner): Added part of event banner {data}")
-                self.banners[-1] += data
+            if self._banner_fetch and self._banner_parts is not None:
+                logging.debug("ShopChecker (Banner): Added part of event banner %s", data)
+                self._banner_parts.append(data)
+
+        def _finish_banner(self):
+            if self._banner_parts is not None:
+                self.banners.append("".join(self._banner_parts))
+                self._banner_parts = None
 
 
 class IngameAdvertisementChecker(UpdateChecker):
 
     def __init__(self, service):
         super().__init__(service)
-        self._title_filters = []
-        filter_env = os.getenv("ADVERTISEMENT_FILTER")
-        if filter_env is not None:
-            self._title_filters = filter_env.split(";")
+        self._title_filters = service.config["advertisement_filter"]
         logging.info(f"IngameAdvertisementChecker: Loaded {len(self._title_filters)} title filter(s).")
 
     def get_interval(self) -> int:
-        return 30
-
-    def tick(self) -> None:
-        advertisement_json: dict = get("https://dl.labymod.net/advertisement/entries.json").json()
-        online_advertisement = [advertisement["title"] for advertisement in
-                                [*advertisement_json["left"], *advertisement_json["right"]]
-                                if advertisement["visible"] and advertisement["isNew"] and
-                                not any(title_filter in advertisement["title"] for title_filter in self._title_filters)]
-
-        current_advertisement = self.service.get_from_save_data("ingame_advertisement")
-        self.service.add_save_data("ingame_advertisement", online_advertisement)
+        return 1800
+
+    def tick(self) -> bool:
+        current_advertisement = self.get_state("ingame_advertisement")
+        advertisement_json = self.http_client.get_json_if_modified(
+            "https://dl.labymod.net/advertisement/entries.json", current_advertisement is not None)
+        if advertisement_json is None:
+            logging.debug("IngameAdvertisementChecker: entries.json not modified.")
+            return False
+        with self.metrics.time_phase("parse"):
+            online_advertisement = self.parse_advertisement(advertisement_json)
+
+        # Every visible entry is kept, so an entry losing its isNew flag or matching a new filter isn't removed
+        self.set_state("ingame_advertisement", list(online_advertisement))
         if current_advertisement is None:
             logging.warning("IngameAdvertisementChecker: No advertisement data found.")
-            return
-
-        new_advertisement = [advertisement for advertisement in online_advertisement if advertisement not
-                             in current_advertisement]
-        if len(new_advertisement) >= 1:
-            self.service.create_news("**New ingame advertisement - Please check!**\n" + "\n".join(new_advertisement),
-                                     "")
+            return False
+
+        with self.metrics.time_phase("diff"):
+            advertisement_diff = diff_items(current_advertisement, online_advertisement)
+        # Only new and unfiltered entries are announced, removals are reported for all of them
+        added = [title for title in advertisement_diff.added if online_advertisement[title]]
+        for title in added:
+            self.emit_event("advertisement.added", title=title)
+        for title in advertisement_diff.removed:
+            self.emit_event("advertisement.removed", title=title)
+        if len(added) >= 1:
+            self.service.create_news("**New ingame advertisement - Please check!**\n" + "\n".join(added), "")
+        if len(advertisement_diff.removed) >= 1:
+            self.service.create_news("**Removed ingame advertisement - Please check!**\n" +
+                                     "\n".join(advertisement_diff.removed), "")
+        return not advertisement_diff.is_empty()
+
+    def parse_advertisement(self, advertisement_json: dict) -> dict:
+        # Visible titles, mapped to whether an addition is announced
+        return {advertisement["title"]: advertisement["isNew"] and
+                not any(title_filter in advertisement["title"] for title_filter in self._title_filters)
+                for advertisement in [*advertisement_json["left"], *advertisement_json["right"]]
+                if advertisement["visible"]}
@@ -0,0 +1,52 @@
+import logging
+import os
+import sys
+import traceback
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable
+
+
+class Watchdog:
+    # Watches the ticker from its own thread, a stalled ticker can't notice that itself
+
+    def __init__(self, thread_id: int, on_stall: Callable[[], None] = None):
+        self._thread_id = thread_id
+        self._on_stall = on_stall
+        # The ticker wakes up at least once a minute
+        self.timeout = float(os.getenv("WATCHDOG_TIMEOUT", "180"))
+        self._last_beat = monotonic()
+        self._reported = False
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="watchdog", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def beat(self):
+        self._last_beat = monotonic()
+
+    @property
+    def stalled_for(self) -> float:
+        # Seconds past the deadline, 0 while the ticker is alive
+        return max(monotonic() - self._last_beat - self.timeout, 0.0)
+
+    def _run(self):
+        while not self._stopped.wait(min(self.timeout / 4, 10)):
+            if self.stalled_for == 0:
+                if self._reported:
+                    logging.info("Watchdog: Ticker recovered.")
+                    self._reported = False
+                continue
+            if self._reported:
+                continue
+            self._reported = True
+            frame = sys._current_frames().get(self._thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unknown"
+            logging.error(f"Watchdog: Ticker missed its deadline by {self.stalled_for:.0f}s, it's stuck in:\n{stack}")
+            if self._on_stall is not None:
+                self._on_stall()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
@@ -0,0 +1,75 @@
+import logging
+import os
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+class ExtractionParser(HTMLParser):
+    # Subclasses set up all of their state in reset, so nothing of one document is left for the next
+
+    def reset(self):
+        super().reset()
+        # Set once everything needed was parsed, so the rest of the page doesn't have to be read
+        self.done = False
+
+    def start_document(self):
+        # Drop markup left over from a document which wasn't read to the end
+        self.reset()
+
+
+class _LxmlTarget:
+
+    def __init__(self, parser: ExtractionParser):
+        self._parser = parser
+
+    def start(self, tag, attributes):
+        if not self._parser.done:
+            self._parser.handle_starttag(tag, list(attributes.items()))
+
+    def end(self, tag):
+        if not self._parser.done:
+            self._parser.handle_endtag(tag)
+
+    def data(self, data):
+        if not self._parser.done:
+            self._parser.handle_data(data)
+
+    def close(self):
+        pass
+
+
+class _LxmlFeeder:
+
+    def __init__(self, parser: ExtractionParser):
+        self._parser = parser
+        self._lxml_parser = etree.HTMLParser(target=_LxmlTarget(parser))
+
+    @property
+    def done(self) -> bool:
+        return self._parser.done
+
+    def feed(self, data: str):
+        self._lxml_parser.feed(data)
+
+    def close(self):
+        self._lxml_parser.close()
+
+
+def _get_backend() -> str:
+    backend = os.getenv("HTML_BACKEND", "html.parser")
+    if backend == "lxml" and etree is None:
+        logging.warning("lxml is not installed, falling back to html.parser.")
+        return "html.parser"
+    return backend
+
+
+def create_feeder(parser: ExtractionParser):
+    # Both backends drive the same handlers, so the parsers keep their output structures
+    parser.start_document()
+    if _get_backend() == "lxml":
+        return _LxmlFeeder(parser)
+    return parser
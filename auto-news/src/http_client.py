@@ -0,0 +1,288 @@
+import logging
+import os
+from codecs import getincrementaldecoder
+from hashlib import blake2b
+from json import load as json_load
+from threading import Lock, local
+from time import monotonic, perf_counter
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fetch_cache import FetchCache, FetchCacheEntry
+from metrics import Metrics
+from persistence import encode, write_atomic
+
+
+class HttpClient:
+
+    def __init__(self, validator_cache_path: str = "./http_cache.json", metrics: Metrics = None):
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._timeout = (float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")), float(os.getenv("HTTP_READ_TIMEOUT", "20")))
+        # Only idempotent requests are retried, webhook posts are not
+        retry = Retry(total=int(os.getenv("HTTP_RETRIES", "3")),
+                      backoff_factor=float(os.getenv("HTTP_RETRY_BACKOFF", "0.5")),
+                      status_forcelist=(500, 502, 503, 504), allowed_methods=("GET", "HEAD"),
+                      respect_retry_after_header=True, raise_on_status=False)
+        # One pool per host, connections are kept alive between ticks
+        self._adapter = HTTPAdapter(pool_connections=int(os.getenv("HTTP_POOL_HOSTS", "10")),
+                                    pool_maxsize=int(os.getenv("HTTP_POOL_SIZE", "10")), max_retries=retry)
+        self._session = Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._validators = ValidatorCache(validator_cache_path)
+        # Shared by all grabbers, a download is used by the others for the ttl
+        self._fetch_cache = FetchCache(float(os.getenv("FETCH_CACHE_TTL", "30")),
+                                       int(os.getenv("FETCH_CACHE_MAX_ENTRIES", "64")),
+                                       int(os.getenv("FETCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024))))
+        # Optional PayloadArchive recording every fetched payload for replays
+        self.archive = None
+        logging.info(f"HttpClient: Using timeouts {self._timeout} (connect, read).")
+
+    def get(self, url: str, **kwargs) -> Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Response:
+        return self.request("POST", url, **kwargs)
+
+    def get_if_modified(self, url: str, conditional: bool = True, **kwargs) -> Response | None:
+        # Returns None if the resource didn't change since the last fetch committed by the calling grabber
+        requested_at = monotonic()
+        consumer = self._metrics.grabber
+        entry = self._validators.get(consumer, url) if conditional else None
+        with self._fetch_cache.lock(url):
+            cached = self._fetch_cache.get(url, requested_at, consumer)
+            if cached is not None and (cached.response is not None or entry is not None and
+                                       cached.validators == entry):
+                self._metrics.inc_grabber("auto_news_grabber_shared_fetches_total")
+                if cached.response is None:
+                    return None
+                return None if self._stage_validators(consumer, url, entry, cached.validators) else cached.response
+
+            start = perf_counter()
+            response = self._get_conditional(url, entry, **kwargs)
+            if response is None:
+                self._metrics.observe_phase("fetch", perf_counter() - start)
+                self._fetch_cache.put(url, FetchCacheEntry(entry, consumer=consumer))
+                if self.archive is not None:
+                    self.archive.record_unchanged(url)
+                return None
+            content = response.content
+            self._metrics.observe_phase("fetch", perf_counter() - start)
+            if self.archive is not None:
+                self.archive.record(url, content, response.encoding)
+            self._metrics.inc_grabber("auto_news_grabber_downloaded_bytes_total", len(content))
+            validators = self._get_validators(response, blake2b(content, digest_size=16).hexdigest())
+            self._fetch_cache.put(url, FetchCacheEntry(validators, response=response, consumer=consumer))
+            return None if self._stage_validators(consumer, url, entry, validators) else response
+
+    def get_json_if_modified(self, url: str, conditional: bool = True, **kwargs):
+        # Parsed once per download, the result is shared and must not be mutated
+        response = self.get_if_modified(url, conditional, **kwargs)
+        if response is None:
+            return None
+        cached = self._fetch_cache.get(url, 0.0)
+        with self._metrics.time_phase("parse"):
+            if cached is None or cached.response is not response:
+                # Evicted in the meantime
+                return response.json()
+            return self._fetch_cache.get_parsed(url, cached, "json", response.json)
+
+    def stream_if_modified(self, url: str, parser, conditional: bool = True, chunk_size: int = 16384) -> bool:
+        # Feeds the parser chunk by chunk until it's done, returns False if the resource didn't change
+        requested_at = monotonic()
+        consumer = self._metrics.grabber
+        entry = self._validators.get(consumer, url) if conditional else None
+        with self._fetch_cache.lock(url):
+            cached = self._fetch_cache.get(url, requested_at, consumer)
+            if cached is not None and (cached.chunks is not None or entry is not None and cached.validators == entry):
+                self._metrics.inc_grabber("auto_news_grabber_shared_fetches_total")
+                if cached.chunks is None or self._stage_validators(consumer, url, entry, cached.validators):
+                    return False
+                self._replay(url, cached, parser)
+                return True
+
+            start = perf_counter()
+            response = self._get_conditional(url, entry, stream=True)
+            if response is None:
+                self._metrics.observe_phase("fetch", perf_counter() - start)
+                self._fetch_cache.put(url, FetchCacheEntry(entry, consumer=consumer))
+                if self.archive is not None:
+                    self.archive.record_unchanged(url)
+                return False
+            content_hash = blake2b(digest_size=16)
+            decoder = getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            chunks = []
+            complete = False
+            # Download and parsing interleave, so the parse time is taken out of the fetch time
+            parse_time = 0.0
+            with response:
+                for chunk in response.iter_content(chunk_size):
+                    chunks.append(chunk)
+                    content_hash.update(chunk)
+                    parse_start = perf_counter()
+                    parser.feed(decoder.decode(chunk))
+                    parse_time += perf_counter() - parse_start
+                    if parser.done:
+                        logging.debug("HttpClient: Stopped reading %s early.", url)
+                        break
+                else:
+                    complete = True
+                    parse_start = perf_counter()
+                    parser.feed(decoder.decode(b"", final=True))
+                    parser.close()
+                    parse_time += perf_counter() - parse_start
+            self._metrics.observe_phase("fetch", perf_counter() - start - parse_time)
+            self._metrics.observe_phase("parse", parse_time)
+            self._metrics.inc_grabber("auto_news_grabber_downloaded_bytes_total", sum(len(chunk) for chunk in chunks))
+            if self.archive is not None:
+                # Only what was read, the parser didn't need the rest
+                self.archive.record(url, b"".join(chunks), response.encoding)
+            # Only the part read is hashed, which is the part the parser cares about
+            validators = self._get_validators(response, content_hash.hexdigest())
+            self._fetch_cache.put(url, FetchCacheEntry(validators, chunks=chunks, complete=complete,
+                                                       encoding=response.encoding, consumer=consumer))
+            return not self._stage_validators(consumer, url, entry, validators)
+
+    def _replay(self, url: str, cached, parser):
+        decoder = getincrementaldecoder(cached.encoding or "utf-8")(errors="replace")
+        with self._metrics.time_phase("parse"):
+            for chunk in cached.chunks:
+                parser.feed(decoder.decode(chunk))
+                if parser.done:
+                    return
+            if not cached.complete:
+                # Only happens if the parser needs more than the one which downloaded it
+                logging.warning(f"HttpClient: Shared download of {url} ended before the parser was done.")
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+
+    def clear_fetch_cache(self):
+        self._fetch_cache.clear()
+
+    @property
+    def fetch_cache_size(self) -> int:
+        return self._fetch_cache.size
+
+    def _get_conditional(self, url: str, entry: dict | None, **kwargs) -> Response | None:
+        headers = kwargs.pop("headers", {})
+        if entry is not None:
+            if entry.get("etag") is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified") is not None:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.get(url, headers=headers, **kwargs)
+        if response.status_code == 304:
+            logging.debug("HttpClient: %s not modified (304).", url)
+            response.close()
+            return None
+        return response
+
+    @staticmethod
+    def _get_validators(response: Response, content_hash: str) -> dict:
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "hash": content_hash
+        }
+
+    def _stage_validators(self, consumer: str | None, url: str, entry: dict | None, validators: dict) -> bool:
+        # Returns True if the calling grabber already handled this content
+        self._validators.stage(consumer, url, validators)
+        # Fallback for servers without validators
+        if entry is not None and entry.get("hash") == validators["hash"]:
+            logging.debug("HttpClient: %s not modified (same content).", url)
+            return True
+        return False
+
+    def commit_validators(self) -> dict:
+        return self._validators.commit()
+
+    def merge_validators(self, entries: dict):
+        # Validators committed by a worker process
+        self._validators.update(entries)
+
+    def discard_validators(self):
+        self._validators.discard()
+
+    def flush_validators(self):
+        self._validators.flush()
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        kwargs.setdefault("timeout", self._timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def get_connection_stats(self) -> dict:
+        stats = {}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(key.key_host, {"requests": 0, "connections": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+        for host_stats in stats.values():
+            host_stats["reused"] = max(host_stats["requests"] - host_stats["connections"], 0)
+        return stats
+
+    def close(self):
+        self._session.close()
+
+
+class ValidatorCache:
+    # Validators by grabber and url, every grabber looks for changes since the content it handled itself
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = Lock()
+        # Validators are staged per thread and only committed once the grabber handled the response
+        self._staged = local()
+        self._dirty = False
+        try:
+            with open(self._path, "r", encoding="UTF-8") as file_in:
+                self._entries = json_load(file_in)
+            logging.info(f"ValidatorCache: Loaded {len(self._entries)} entries.")
+        except (FileNotFoundError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def _key(consumer: str | None, url: str) -> str:
+        return url if consumer is None else f"{consumer} {url}"
+
+    def get(self, consumer: str | None, url: str) -> dict | None:
+        with self._lock:
+            return self._entries.get(self._key(consumer, url))
+
+    def stage(self, consumer: str | None, url: str, entry: dict):
+        if not hasattr(self._staged, "entries"):
+            self._staged.entries = {}
+        self._staged.entries[self._key(consumer, url)] = entry
+
+    def commit(self) -> dict:
+        # Returns the committed entries
+        staged = getattr(self._staged, "entries", None)
+        if not staged:
+            return {}
+        self._staged.entries = {}
+        self.update(staged)
+        return staged
+
+    def update(self, entries: dict):
+        with self._lock:
+            if any(self._entries.get(url) != entry for url, entry in entries.items()):
+                self._dirty = True
+            self._entries.update(entries)
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            content = encode(self._entries)
+        write_atomic(self._path, content)
+
+    def discard(self):
+        self._staged.entries = {}
@@ -0,0 +1,236 @@
+import logging
+import os
+import signal
+import traceback
+from copy import deepcopy
+from json import loads as json_loads
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from threading import RLock
+from time import monotonic
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, workers run without limits there
+    resource = None
+
+from http_client import HttpClient
+from metrics import Metrics
+from persistence import encode
+from registry import get_grabber_class
+from tenants import TenantContext
+
+
+class GrabberWorkerError(RuntimeError):
+    pass
+
+
+def _send(connection: Connection, message: dict):
+    # Compact json, state values are json anyway
+    connection.send_bytes(encode(message).encode())
+
+
+def _receive(connection: Connection) -> dict:
+    return json_loads(connection.recv_bytes())
+
+
+class GrabberWorker:
+    # Runs one grabber in its own process, so parsing uses another core and a runaway grabber can be killed.
+    # The worker reads state from us while it runs, its news, state writes and validators come back at the end.
+
+    def __init__(self, name: str, tenant_config: dict, grabber_name: str, timeout: float):
+        self.name = name
+        self._tenant_config = tenant_config
+        self._grabber_name = grabber_name
+        self._timeout = timeout
+        self._memory_limit = int(os.getenv("GRABBER_MEMORY_LIMIT_MB", "512")) * 1024 * 1024
+        self._cpu_limit = int(os.getenv("GRABBER_CPU_LIMIT", "30"))
+        # Interval of the grabber after its last run
+        self.interval = None
+        self._process = None
+        self._connection = None
+
+    def _start(self):
+        # Spawned, forking a process with running threads isn't safe
+        context = get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_worker_main, name=f"grabber-{self.name}", daemon=True,
+                                        args=(child_connection, self._tenant_config, self._grabber_name, self.name,
+                                              logging.getLogger().getEffectiveLevel(), self._memory_limit,
+                                              self._cpu_limit))
+        self._process.start()
+        child_connection.close()
+        logging.info(f"Started worker process {self._process.pid} for grabber {self.name}.")
+
+    def tick(self, service) -> bool:
+        if self._process is None or not self._process.is_alive():
+            self.close()
+            self._start()
+        deadline = monotonic() + self._timeout
+        try:
+            _send(self._connection, {"op": "tick"})
+            while True:
+                if not self._connection.poll(max(deadline - monotonic(), 0)):
+                    self.close()
+                    raise GrabberWorkerError(f"Killed the worker of {self.name} after {self._timeout}s.")
+                message = _receive(self._connection)
+                if message["op"] == "get":
+                    _send(self._connection, {"value": service.get_from_save_data(message["namespace"],
+                                                                                 message["key"])})
+                elif message["op"] == "log":
+                    logging.log(message["level"], message["message"])
+                elif message["op"] == "error":
+                    service.metrics.merge(message["metrics"])
+                    if message["fatal"]:
+                        self.close()
+                    raise GrabberWorkerError(f"Grabber {self.name} failed in its worker:\n{message['error']}")
+                else:
+                    return self._apply(service, message)
+        except (EOFError, OSError) as exception:
+            raise GrabberWorkerError(f"Worker of {self.name} died: {self._describe_exit()}") from exception
+
+    def _apply(self, service, result: dict) -> bool:
+        service.metrics.merge(result["metrics"])
+        for message_content, news_content, webhook_urls in result["news"]:
+            service.create_news(message_content, news_content, webhook_urls)
+        for event_type, data, tenant in result["events"]:
+            service.emit_event(event_type, data, tenant)
+        for namespace, config_key, value in result["state"]:
+            service.add_save_data(namespace, config_key, value)
+        service.http_client.merge_validators(result["validators"])
+        self.interval = result["interval"]
+        return result["changed"]
+
+    def _describe_exit(self) -> str:
+        if self._process is None:
+            return "stopped"
+        self._process.join(timeout=1)
+        exit_code = self._process.exitcode
+        self.close()
+        if exit_code is None:
+            return "connection lost"
+        if resource is not None and exit_code == -signal.SIGXCPU:
+            return f"exceeded the CPU limit of {self._cpu_limit}s"
+        return f"exit code {exit_code}"
+
+    def close(self):
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join(timeout=5)
+        self._connection.close()
+        self._process = None
+        self._connection = None
+
+
+class _PipeLoggingHandler(logging.Handler):
+    # Log records go to the parent, so they end up in its log files
+
+    def __init__(self, connection: Connection, lock: RLock):
+        super().__init__()
+        self._connection = connection
+        self._lock = lock
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            message = self.format(record)
+            with self._lock:
+                _send(self._connection, {"op": "log", "level": record.levelno, "message": message})
+        except Exception:
+            self.handleError(record)
+
+
+class _WorkerService:
+    # Stands in for AutoNewsService inside the worker
+
+    def __init__(self, connection: Connection, lock: RLock):
+        self._connection = connection
+        self._lock = lock
+        self.metrics = Metrics()
+        self.http_client = HttpClient(metrics=self.metrics)
+        # Written state by (namespace, key), created news and events of the current run
+        self.state = {}
+        self.news = []
+        self.events = []
+
+    def get_from_save_data(self, namespace: str, config_key: str):
+        if (namespace, config_key) in self.state:
+            return deepcopy(self.state[(namespace, config_key)])
+        with self._lock:
+            _send(self._connection, {"op": "get", "namespace": namespace, "key": config_key})
+            return _receive(self._connection)["value"]
+
+    def add_save_data(self, namespace: str, config_key: str, value):
+        self.state[(namespace, config_key)] = deepcopy(value)
+
+    def create_news(self, message_content: str, news_content: str, webhook_urls: list = None):
+        self.news.append([message_content, news_content, webhook_urls])
+
+    def emit_event(self, event_type: str, data: dict, tenant: str = None):
+        self.events.append([event_type, data, tenant])
+
+    def reset(self):
+        self.state = {}
+        self.news = []
+        self.events = []
+
+
+def _limit_cpu(seconds: int):
+    # The limit counts the whole life of the process, so it's moved forward before every run
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(usage.ru_utime + usage.ru_stime) + 1 + seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+
+
+def _worker_main(connection: Connection, tenant_config: dict, grabber_name: str, label: str, log_level: int,
+                 memory_limit: int, cpu_limit: int):
+    lock = RLock()
+    handler = _PipeLoggingHandler(connection, lock)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(log_level)
+    if resource is not None and memory_limit > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+    service = _WorkerService(connection, lock)
+    tenant = TenantContext(service, tenant_config)
+    grabber = None
+    while True:
+        # Every message is a tick, the parent stops us by closing the pipe or killing us
+        try:
+            _receive(connection)
+        except EOFError:
+            return
+        if resource is not None and cpu_limit > 0:
+            _limit_cpu(cpu_limit)
+        service.metrics.bind_grabber(label)
+        try:
+            if grabber is None:
+                grabber = get_grabber_class(grabber_name)(tenant)
+            changed = bool(grabber.tick())
+        except Exception as exception:
+            service.http_client.discard_validators()
+            service.reset()
+            # Out of memory leaves the process in a state not worth keeping
+            with lock:
+                _send(connection, {"op": "error", "error": traceback.format_exc(), "metrics": service.metrics.drain(),
+                                   "fatal": isinstance(exception, MemoryError)})
+            continue
+        finally:
+            service.metrics.bind_grabber(None)
+        result = {
+            "op": "done",
+            "changed": changed,
+            "interval": grabber.get_interval(),
+            "news": service.news,
+            "events": service.events,
+            "state": [[namespace, config_key, value] for (namespace, config_key), value in service.state.items()],
+            "validators": service.http_client.commit_validators(),
+            "metrics": service.metrics.drain()
+        }
+        service.reset()
+        with lock:
+            _send(connection, result)
@@ -0,0 +1,57 @@
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+
+class LocalServer:
+    # Small embedded http server, routes get the query and return (status, content type, body)
+
+    def __init__(self, host: str, port: int):
+        self._routes = {}
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, name="local-server", daemon=True)
+
+    def add_route(self, path: str, handler: Callable[[dict], tuple[int, str, str]]):
+        self._routes[path] = handler
+
+    def _create_handler(self):
+        routes = self._routes
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                handler = routes.get(url.path)
+                if handler is None:
+                    self.send_error(404)
+                    return
+                try:
+                    status, content_type, body = handler({key: values[-1] for key, values
+                                                          in parse_qs(url.query).items()})
+                except Exception as exception:
+                    logging.exception(exception)
+                    self.send_error(500)
+                    return
+                body = body.encode("UTF-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *arguments):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"LocalServer: Listening on {self._server.server_address[0]}:{self._server.server_address[1]}.")
+
+    def close(self):
+        if self._thread.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
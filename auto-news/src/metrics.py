@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = Lock()
+        # Keyed by metric name, then by sorted label tuples
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+        # Grabber the current thread is running for
+        self._local = local()
+
+    def bind_grabber(self, grabber_name: str | None):
+        self._local.grabber = grabber_name
+
+    @property
+    def grabber(self) -> str | None:
+        return getattr(self._local, "grabber", None)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = self._label_key(labels)
+        with self._lock:
+            metric = self._counters.setdefault(name, {})
+            metric[key] = metric.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = self._label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._label_key(labels)
+        with self._lock:
+            summary = self._summaries.setdefault(name, {}).setdefault(key, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def time_phase(self, phase: str):
+        return self.time("auto_news_grabber_phase_seconds", grabber=self.grabber, phase=phase)
+
+    def observe_phase(self, phase: str, seconds: float):
+        self.observe("auto_news_grabber_phase_seconds", seconds, grabber=self.grabber, phase=phase)
+
+    def inc_grabber(self, name: str, value: float = 1.0):
+        self.inc(name, value, grabber=self.grabber)
+
+    @staticmethod
+    def _label_key(labels: dict) -> tuple:
+        return tuple(sorted((name, value) for name, value in labels.items() if value is not None))
+
+    @staticmethod
+    def _format(name: str, key: tuple, value: float) -> str:
+        if len(key) == 0:
+            return f"{name} {value}"
+        labels = ",".join(f'{label}="{str(label_value).replace(chr(34), "")}"' for label, label_value in key)
+        return f"{name}{{{labels}}} {value}"
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(self._format(name, key, value) for key, value in metric.items())
+            for name, metric in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(self._format(name, key, value) for key, value in metric.items())
+            for name, metric in sorted(self._summaries.items()):
+                lines.append(f"# TYPE {name} summary")
+                for key, (count, total, maximum) in metric.items():
+                    lines.append(self._format(f"{name}_count", key, count))
+                    lines.append(self._format(f"{name}_sum", key, total))
+                lines.append(f"# TYPE {name}_max gauge")
+                lines.extend(self._format(f"{name}_max", key, maximum) for key, (_, _, maximum) in metric.items())
+        return "\n".join(lines) + "\n"
+
+    def drain(self) -> dict:
+        # Hands everything recorded so far to another Metrics, like the one of the parent of a worker process
+        with self._lock:
+            drained = {
+                "counters": [[name, key, value] for name, metric in self._counters.items()
+                             for key, value in metric.items()],
+                "gauges": [[name, key, value] for name, metric in self._gauges.items() for key, value in metric.items()],
+                "summaries": [[name, key, summary] for name, metric in self._summaries.items()
+                              for key, summary in metric.items()]
+            }
+            self._counters = {}
+            self._gauges = {}
+            self._summaries = {}
+        return drained
+
+    def merge(self, drained: dict):
+        with self._lock:
+            for name, key, value in drained["counters"]:
+                metric = self._counters.setdefault(name, {})
+                key = tuple(tuple(label) for label in key)
+                metric[key] = metric.get(key, 0.0) + value
+            for name, key, value in drained["gauges"]:
+                self._gauges.setdefault(name, {})[tuple(tuple(label) for label in key)] = value
+            for name, key, (count, total, maximum) in drained["summaries"]:
+                summary = self._summaries.setdefault(name, {}).setdefault(tuple(tuple(label) for label in key),
+                                                                            [0, 0.0, 0.0])
+                summary[0] += count
+                summary[1] += total
+                summary[2] = max(summary[2], maximum)
@@ -0,0 +1,260 @@
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+from abc import ABC, abstractmethod
+from copy import deepcopy
+from json import dumps as json_dumps, loads as json_loads
+from threading import Lock
+from urllib.parse import quote
+
+STATE_VERSION = 2
+# Grabber owning each key of the flat version 1 save data
+_V1_NAMESPACES = {
+    "labymod_staff": "StaffChecker",
+    "labymod_shop": "ShopChecker",
+    "top_banner": "ShopChecker",
+    "ingame_advertisement": "IngameAdvertisementChecker"
+}
+
+
+def write_atomic(path: str, content: str):
+    # Write to a temp file in the same directory and rename it over the target, so a crash never leaves half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="UTF-8") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Persist the rename itself
+    if hasattr(os, "O_DIRECTORY"):
+        directory_descriptor = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
+
+
+def encode(value) -> str:
+    return json_dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def compact_ids(ids) -> list[int]:
+    return sorted(int(item_id) for item_id in ids)
+
+
+def compact_staff(staff: dict) -> dict:
+    # Every rank is stored once, members point to it by index
+    ranks = {}
+    members = {staff_uuid: [staff_data["name"], ranks.setdefault(staff_data["rank"], len(ranks))]
+               for staff_uuid, staff_data in staff.items()}
+    return {"ranks": list(ranks), "members": members}
+
+
+def expand_staff(compact: dict) -> dict:
+    ranks = [sys.intern(rank) for rank in compact["ranks"]]
+    return {staff_uuid: {"name": name, "rank": ranks[rank_index]}
+            for staff_uuid, (name, rank_index) in compact["members"].items()}
+
+
+def migrate_v1(data: dict) -> dict:
+    # Splits the flat save data into one snapshot per grabber, tenant keys are prefixed with "name:"
+    snapshots = {}
+    for prefixed_key, value in data.items():
+        tenant, _, key = prefixed_key.rpartition(":")
+        namespace = "VersionChecker" if key.startswith("labymod_version") else _V1_NAMESPACES.get(key, "Legacy")
+        if key == "labymod_staff" and value is not None:
+            value = compact_staff(value)
+        elif key == "labymod_shop" and value is not None:
+            value = dict(value, items=compact_ids(value["items"]))
+        snapshots.setdefault(f"{tenant}:{namespace}" if tenant else namespace, {})[key] = value
+    return snapshots
+
+
+class StateStore(ABC):
+    # Every grabber owns a namespaced snapshot, which is loaded on first access and only written when changed
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._snapshots = {}
+        self._dirty = set()
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            return self._snapshot(namespace).get(key)
+
+    def set(self, namespace: str, key: str, value) -> None:
+        with self._lock:
+            # Copy, grabbers keep mutating their parser results after handing them over
+            self._snapshot(namespace)[key] = deepcopy(value)
+            self._dirty.add(namespace)
+
+    def invalidate(self, namespace: str) -> None:
+        # Reloaded on next access, another instance may have written it
+        with self._lock:
+            if namespace not in self._dirty:
+                self._snapshots.pop(namespace, None)
+
+    def _snapshot(self, namespace: str) -> dict:
+        snapshot = self._snapshots.get(namespace)
+        if snapshot is None:
+            snapshot = self._snapshots[namespace] = self._load(namespace)
+            logging.debug("StateStore: Loaded snapshot %s.", namespace)
+        return snapshot
+
+    @abstractmethod
+    def _load(self, namespace: str) -> dict:
+        pass
+
+    @abstractmethod
+    def _write(self, snapshots: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                if len(self._dirty) == 0:
+                    return
+                namespaces = self._dirty
+                self._dirty = set()
+                snapshots = {namespace: encode(self._snapshots[namespace]) for namespace in namespaces}
+            try:
+                self._write(snapshots)
+            except Exception:
+                # Keep them dirty for the next flush
+                with self._lock:
+                    self._dirty.update(namespaces)
+                raise
+            logging.debug("StateStore: Flushed %s snapshot(s).", len(namespaces))
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemoryStateStore(StateStore):
+    # Nothing is written, used for dry runs
+
+    def _load(self, namespace: str) -> dict:
+        return {}
+
+    def _write(self, snapshots: dict) -> None:
+        pass
+
+
+class JsonStateStore(StateStore):
+    # One file per snapshot next to a manifest with the format version
+
+    def __init__(self, directory: str, legacy_json_path: str = None):
+        super().__init__()
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, "manifest.json")
+        try:
+            with open(manifest_path, "r", encoding="UTF-8") as file_in:
+                version = json_loads(file_in.read())["version"]
+        except FileNotFoundError:
+            if legacy_json_path is not None:
+                self._migrate(legacy_json_path)
+            write_atomic(manifest_path, encode({"version": STATE_VERSION}))
+            return
+        if version > STATE_VERSION:
+            raise ValueError(f"State in {directory} has version {version}, only {STATE_VERSION} is supported.")
+
+    def _migrate(self, legacy_json_path: str):
+        try:
+            with open(legacy_json_path, "r", encoding="UTF-8") as file_in:
+                legacy_data = json_loads(file_in.read())
+        except FileNotFoundError:
+            logging.warning("No save date file found.")
+            return
+        snapshots = migrate_v1(legacy_data)
+        self._write({namespace: encode(snapshot) for namespace, snapshot in snapshots.items()})
+        logging.info(f"JsonStateStore: Migrated {len(legacy_data)} key(s) from {legacy_json_path} into "
+                     f"{len(snapshots)} snapshot(s).")
+
+    def _path(self, namespace: str) -> str:
+        # Tenant namespaces contain a colon
+        return os.path.join(self._directory, f"{quote(namespace, safe='')}.json")
+
+    def _load(self, namespace: str) -> dict:
+        try:
+            with open(self._path(namespace), "r", encoding="UTF-8") as file_in:
+                return json_loads(file_in.read())
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, snapshots: dict) -> None:
+        for namespace, content in snapshots.items():
+            write_atomic(self._path(namespace), content)
+
+
+class SqliteStateStore(StateStore):
+
+    def __init__(self, path: str, legacy_json_path: str = None):
+        super().__init__()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS snapshots (namespace TEXT PRIMARY KEY, "
+                                     "value TEXT NOT NULL)")
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None:
+            self._migrate(legacy_json_path)
+        elif int(row[0]) > STATE_VERSION:
+            raise ValueError(f"State in {path} has version {row[0]}, only {STATE_VERSION} is supported.")
+
+    def _migrate(self, legacy_json_path: str | None):
+        # Version 1 kept flat keys in a state table, before that there was only the json file
+        legacy_data = None
+        if self._connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state'") \
+                .fetchone() is not None:
+            legacy_data = {key: json_loads(value) for key, value in
+                           self._connection.execute("SELECT key, value FROM state")}
+        elif legacy_json_path is not None:
+            try:
+                with open(legacy_json_path, "r", encoding="UTF-8") as file_in:
+                    legacy_data = json_loads(file_in.read())
+            except FileNotFoundError:
+                pass
+        snapshots = migrate_v1(legacy_data) if legacy_data is not None else {}
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO snapshots (namespace, value) VALUES (?, ?)",
+                                         [(namespace, encode(snapshot)) for namespace, snapshot in snapshots.items()])
+            self._connection.execute("DROP TABLE IF EXISTS state")
+            self._connection.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (str(STATE_VERSION),))
+        if legacy_data is not None:
+            logging.info(f"SqliteStateStore: Migrated {len(legacy_data)} key(s) into {len(snapshots)} snapshot(s).")
+
+    def _load(self, namespace: str) -> dict:
+        row = self._connection.execute("SELECT value FROM snapshots WHERE namespace = ?", (namespace,)).fetchone()
+        return {} if row is None else json_loads(row[0])
+
+    def _write(self, snapshots: dict) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO snapshots (namespace, value) VALUES (?, ?)",
+                                         list(snapshots.items()))
+
+    def close(self) -> None:
+        super().close()
+        self._connection.close()
+
+
+def create_state_store() -> StateStore:
+    backend = os.getenv("STATE_BACKEND", "json").lower()
+    # Save data of version 1 is migrated on first start
+    if backend == "sqlite":
+        logging.info("Using SQLite state backend.")
+        return SqliteStateStore(os.getenv("STATE_PATH", "./news_data.db"), "./news_data.json")
+    return JsonStateStore(os.getenv("STATE_DIR", "./state"), os.getenv("STATE_PATH", "./news_data.json"))
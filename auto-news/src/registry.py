@@ -0,0 +1,61 @@
+import inspect
+import logging
+import os
+from importlib import import_module
+from importlib.metadata import entry_points
+from threading import Lock
+
+import grabbers
+from update_checker import UpdateChecker
+
+# Installed packages register grabbers under this group, the entry point name is the name used in the config
+ENTRY_POINT_GROUP = "auto_news.grabbers"
+
+_lock = Lock()
+_classes = {}
+_discovered = False
+
+
+def _builtin_classes() -> dict:
+    return {name: value for name, value in vars(grabbers).items() if _is_grabber_class(value)}
+
+
+def _is_grabber_class(value) -> bool:
+    return inspect.isclass(value) and issubclass(value, UpdateChecker) and not inspect.isabstract(value)
+
+
+def _load(name: str, reference: str, origin: str):
+    # A reference is module:Class
+    module_name, _, attribute = reference.partition(":")
+    value = getattr(import_module(module_name), attribute)
+    if not _is_grabber_class(value):
+        raise TypeError(f"Grabber {name} from {origin} isn't an UpdateChecker: {reference}")
+    _classes[name] = value
+    logging.debug("Registry: Registered grabber %s from %s.", name, origin)
+
+
+def _discover():
+    # Only runs for names that aren't built in, scanning the installed packages takes a while
+    global _discovered
+    # GRABBER_PLUGINS=Name=module:Class;... for grabbers that aren't installed as a package
+    for plugin in (os.getenv("GRABBER_PLUGINS") or "").split(";"):
+        if plugin.strip() == "":
+            continue
+        name, _, reference = plugin.partition("=")
+        _load(name.strip(), reference.strip(), "GRABBER_PLUGINS")
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name not in _classes:
+            _load(entry_point.name, entry_point.value, f"entry point of {entry_point.dist.name}"
+                  if entry_point.dist is not None else "entry point")
+    _discovered = True
+
+
+def get_grabber_class(name: str) -> type[UpdateChecker]:
+    with _lock:
+        if len(_classes) == 0:
+            _classes.update(_builtin_classes())
+        if name not in _classes and not _discovered:
+            _discover()
+        if name not in _classes:
+            raise KeyError(f"Unknown grabber {name}, known are {', '.join(sorted(_classes))}.")
+        return _classes[name]
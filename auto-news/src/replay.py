@@ -0,0 +1,179 @@
+import logging
+from datetime import datetime, timezone
+from json import loads as json_loads
+from time import perf_counter
+
+from requests import Response
+
+from archive import PayloadArchive
+from metrics import Metrics
+from persistence import MemoryStateStore, encode
+from registry import get_grabber_class
+from tenants import TenantContext, load_tenant_configs
+
+
+class NotArchivedError(LookupError):
+    pass
+
+
+class ReplayHttpClient:
+    # Serves the archived payloads of the current virtual time instead of fetching them
+
+    def __init__(self, archive: PayloadArchive, metrics: Metrics = None):
+        self._archive = archive
+        self._metrics = metrics if metrics is not None else Metrics()
+        # Archive entry by url at the current virtual time
+        self._current = {}
+        # Content hash by grabber and url the grabbers handled, like the validators of HttpClient
+        self._handled = {}
+        self._staged = {}
+        # Decoded and parsed payload by url, replays are in order so only the latest is kept
+        self._texts = {}
+        self._parsed = {}
+
+    def advance(self, entry: dict):
+        self._current[entry["url"]] = entry
+
+    def _lookup(self, url: str, conditional: bool) -> dict | None:
+        entry = self._current.get(url)
+        if entry is None:
+            raise NotArchivedError(url)
+        key = (self._metrics.grabber, url)
+        self._staged[key] = entry["hash"]
+        if conditional and self._handled.get(key) == entry["hash"]:
+            return None
+        return entry
+
+    def _get_text(self, entry: dict) -> str:
+        # Payloads are decoded once, most ticks see the same content again
+        content_hash, text = self._texts.get(entry["url"], (None, None))
+        if content_hash != entry["hash"]:
+            text = self._archive.load(entry["hash"]).decode(entry["encoding"] or "utf-8", errors="replace")
+            self._texts[entry["url"]] = (entry["hash"], text)
+        return text
+
+    def get_if_modified(self, url: str, conditional: bool = True, **kwargs) -> Response | None:
+        entry = self._lookup(url, conditional)
+        if entry is None:
+            return None
+        response = Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = entry["encoding"]
+        response._content = self._archive.load(entry["hash"])
+        return response
+
+    def get_json_if_modified(self, url: str, conditional: bool = True, **kwargs):
+        entry = self._lookup(url, conditional)
+        if entry is None:
+            return None
+        content_hash, parsed = self._parsed.get(url, (None, None))
+        if content_hash != entry["hash"]:
+            parsed = json_loads(self._get_text(entry))
+            self._parsed[url] = (entry["hash"], parsed)
+        return parsed
+
+    def stream_if_modified(self, url: str, parser, conditional: bool = True, chunk_size: int = 16384) -> bool:
+        entry = self._lookup(url, conditional)
+        if entry is None:
+            return False
+        # Same chunking as a live download
+        text = self._get_text(entry)
+        for position in range(0, len(text), chunk_size):
+            parser.feed(text[position:position + chunk_size])
+            if parser.done:
+                return True
+        parser.close()
+        return True
+
+    def commit_validators(self):
+        self._handled.update(self._staged)
+        self._staged = {}
+
+    def discard_validators(self):
+        self._staged = {}
+
+    def flush_validators(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayService:
+    # Stands in for AutoNewsService, state stays in memory and news are captured instead of posted
+
+    def __init__(self, http_client: ReplayHttpClient, metrics: Metrics = None):
+        self.http_client = http_client
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.virtual_time = 0.0
+        self.news = []
+        self.events = []
+        self._state = MemoryStateStore()
+
+    def get_from_save_data(self, namespace: str, config_key: str):
+        return self._state.get(namespace, config_key)
+
+    def add_save_data(self, namespace: str, config_key: str, value):
+        self._state.set(namespace, config_key, value)
+
+    def emit_event(self, event_type: str, data: dict, tenant: str = None):
+        self.events.append({"time": self.virtual_time, "type": event_type, "tenant": tenant,
+                            "grabber": self.metrics.grabber, "data": data})
+
+    def create_news(self, message_content: str, news_content: str, webhook_urls: list = None):
+        self.metrics.inc_grabber("auto_news_grabber_news_total")
+        self.news.append({
+            "time": datetime.fromtimestamp(self.virtual_time, timezone.utc).isoformat(),
+            "grabber": self.metrics.grabber,
+            "message": message_content,
+            "news": news_content,
+            "webhooks": webhook_urls
+        })
+
+
+def run_replay(archive_directory: str, output_path: str = "./replay_news.jsonl") -> list[dict]:
+    archive = PayloadArchive(archive_directory)
+    entries = sorted(archive.read_entries(), key=lambda entry: entry["time"])
+    # Shared, the client tells the grabbers apart by the one bound to the metrics
+    metrics = Metrics()
+    http_client = ReplayHttpClient(archive, metrics)
+    service = ReplayService(http_client, metrics)
+    tenants = [TenantContext(service, tenant_config) for tenant_config in load_tenant_configs()]
+    grabber_list = [get_grabber_class(grabber_name)(tenant) for tenant in tenants
+                    for grabber_name in tenant.config["grabbers"]]
+
+    # Every archived fetch is a tick at its recorded time, all grabbers run on it
+    start = perf_counter()
+    for entry in entries:
+        http_client.advance(entry)
+        service.virtual_time = entry["time"]
+        for grabber in grabber_list:
+            _run_grabber(service, grabber)
+    duration = perf_counter() - start
+    logging.info(f"Replay: {len(entries)} tick(s) in {duration:.2f}s "
+                 f"({len(entries) / max(duration, 1e-9):.0f} ticks/s), {len(service.news)} news, "
+                 f"{len(service.events)} event(s).")
+
+    with open(output_path, "w", encoding="UTF-8") as file_out:
+        file_out.write("".join(encode(news) + "\n" for news in service.news))
+    logging.info(f"Replay: Wrote news to {output_path}.")
+    return service.news
+
+
+def _run_grabber(service: ReplayService, grabber):
+    name = grabber.service.label(type(grabber).__name__)
+    service.metrics.bind_grabber(name)
+    try:
+        grabber.tick()
+    except NotArchivedError:
+        # Nothing was fetched from this url yet
+        service.http_client.discard_validators()
+        return
+    except Exception as exception:
+        service.http_client.discard_validators()
+        logging.exception(exception)
+        return
+    finally:
+        service.metrics.bind_grabber(None)
+    service.http_client.commit_validators()
@@ -0,0 +1,100 @@
+import heapq
+import logging
+import os
+from itertools import count
+from random import Random
+
+
+class _Schedule:
+    __slots__ = ("factor", "failures", "interval", "group", "deadline")
+
+    def __init__(self, group: str = None):
+        # Multiplier on the grabber's interval, lowered after changes and raised while idle
+        self.factor = 1.0
+        self.failures = 0
+        self.interval = 0.0
+        self.group = group
+        self.deadline = 0.0
+
+
+class Scheduler:
+    # Runs every grabber on its own jittered deadline. Grabbers are known by name, so they can be created on their
+    # first run. Times are monotonic seconds passed in by the caller
+
+    def __init__(self, random: Random = None):
+        self._random = random if random is not None else Random()
+        self._jitter = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+        self._active_factor = float(os.getenv("SCHEDULER_ACTIVE_FACTOR", "0.1"))
+        # Idle grabbers only slow down back to their own interval. Polling less delays every change that isn't part
+        # of a burst, values above 1 save polls at that cost
+        self._idle_factor = float(os.getenv("SCHEDULER_IDLE_FACTOR", "1.0"))
+        self._idle_growth = float(os.getenv("SCHEDULER_IDLE_GROWTH", "1.2"))
+        self._min_interval = float(os.getenv("SCHEDULER_MIN_INTERVAL", "30"))
+        self._max_backoff = float(os.getenv("SCHEDULER_MAX_BACKOFF", "7200"))
+        self._start_spread = float(os.getenv("SCHEDULER_START_SPREAD", "10"))
+        self._schedules = {}
+        self._queue = []
+        # Tie breaker, keeps the order of equal deadlines
+        self._sequence = count()
+
+    def add(self, name: str, now: float, group: str = None):
+        # Spread the first run a little, so grabbers don't start at the same instant. Grabbers of a group fetch the
+        # same urls, like one grabber of several tenants, and start together to share the downloads
+        self._schedules[name] = _Schedule(group)
+        deadline = self._group_deadline(name, now, None)
+        self._push(name, deadline if deadline is not None else now + self._random.uniform(0, self._start_spread))
+
+    def pop_due(self, now: float) -> list[tuple]:
+        # Returns grabbers with how late they are
+        due = []
+        while len(self._queue) > 0 and self._queue[0][0] <= now:
+            deadline, _, name = heapq.heappop(self._queue)
+            due.append((name, now - deadline))
+        return due
+
+    def next_deadline(self) -> float | None:
+        return self._queue[0][0] if len(self._queue) > 0 else None
+
+    def complete(self, name: str, now: float, base: float, changed: bool = False, failed: bool = False) -> float:
+        # Schedules the next run from the grabber's interval and returns the interval used
+        schedule = self._schedules[name]
+        if failed:
+            schedule.failures += 1
+            interval = min(base * 2 ** schedule.failures, max(base, self._max_backoff))
+        else:
+            schedule.failures = 0
+            schedule.factor = self._active_factor if changed else \
+                min(schedule.factor * self._idle_growth, self._idle_factor)
+            interval = base * schedule.factor
+        # A member of the group already drew the jitter for this round, otherwise they drift apart and stop sharing
+        # downloads
+        deadline = self._group_deadline(name, now, (now + interval, self._jitter * interval))
+        if deadline is not None and deadline - now >= self._min_interval:
+            interval = deadline - now
+        else:
+            interval = max(interval * self._random.uniform(1 - self._jitter, 1 + self._jitter), self._min_interval)
+        schedule.interval = interval
+        logging.debug("Scheduler: Next run of %s in %.0fs (changed: %s, failures: %s).", name, interval,
+                      changed, schedule.failures)
+        self._push(name, now + interval)
+        return interval
+
+    def postpone(self, name: str, now: float, delay: float):
+        # Checks again later without counting it as a run
+        self._push(name, now + delay)
+
+    def _group_deadline(self, name: str, now: float, target: tuple[float, float] | None) -> float | None:
+        # Upcoming deadline of another member of the group, within the tolerance of the target if one is given
+        group = self._schedules[name].group
+        if group is None:
+            return None
+        for other_name, other in self._schedules.items():
+            if other_name == name or other.group != group or other.deadline <= now:
+                continue
+            if target is None or abs(other.deadline - target[0]) <= target[1]:
+                return other.deadline
+        return None
+
+    def _push(self, name: str, deadline: float):
+        self._schedules[name].deadline = deadline
+        heapq.heappush(self._queue, (deadline, next(self._sequence), name))
@@ -0,0 +1,81 @@
+import logging
+import os
+from json import loads as json_loads
+
+DEFAULT_GRABBERS = ["VersionChecker", "StaffChecker", "ShopChecker", "IngameAdvertisementChecker"]
+
+
+def _split_env(name: str) -> list:
+    value = os.getenv(name)
+    return [] if value is None or value == "" else value.split(";")
+
+
+def default_tenant_config() -> dict:
+    # Single tenant configured from the environment like before
+    return {
+        "name": "default",
+        "webhooks": _split_env("DISCORD_WEBHOOKS"),
+        "role": os.getenv("DISCORD_ROLE"),
+        "grabbers": list(DEFAULT_GRABBERS),
+        "staff_badge": os.getenv("STAFF_BADGE"),
+        "version_channels": ["1.8.9"],
+        "advertisement_filter": _split_env("ADVERTISEMENT_FILTER"),
+        "filters": []
+    }
+
+
+def load_tenant_configs() -> list[dict]:
+    config_path = os.getenv("TENANTS_CONFIG")
+    if config_path is None:
+        return [default_tenant_config()]
+
+    with open(config_path, "r", encoding="UTF-8") as file_in:
+        tenant_configs = json_loads(file_in.read())["tenants"]
+    # Missing keys fall back to the environment
+    tenant_configs = [{**default_tenant_config(), **tenant_config} for tenant_config in tenant_configs]
+    names = [tenant_config["name"] for tenant_config in tenant_configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Tenant names have to be unique: {names}")
+    # Tenants posting to the same webhook share it, one message can only mention one role
+    roles = {}
+    for tenant_config in tenant_configs:
+        for url in tenant_config["webhooks"]:
+            role = roles.setdefault(url, tenant_config["role"])
+            if role != tenant_config["role"]:
+                raise ValueError(f"Tenant {tenant_config['name']} posts to a webhook shared with another tenant, "
+                                 f"but with role {tenant_config['role']} instead of {role}.")
+    logging.info(f"Loaded {len(tenant_configs)} tenant(s) from {config_path}.")
+    return tenant_configs
+
+
+class TenantContext:
+    # What a grabber sees as its service, state is namespaced and news are routed to the tenant's webhooks
+
+    def __init__(self, service, config: dict):
+        self._service = service
+        self.config = config
+        self.name = config["name"]
+        # The default tenant keeps the unprefixed snapshots of existing save data
+        self._prefix = "" if self.name == "default" else f"{self.name}:"
+        self.http_client = service.http_client
+        self.metrics = service.metrics
+
+    def label(self, grabber_name: str) -> str:
+        return f"{self._prefix}{grabber_name}"
+
+    def get_from_save_data(self, namespace: str, config_key: str):
+        return self._service.get_from_save_data(f"{self._prefix}{namespace}", config_key)
+
+    def add_save_data(self, namespace: str, config_key: str, value):
+        self._service.add_save_data(f"{self._prefix}{namespace}", config_key, value)
+
+    def create_news(self, message_content: str, news_content: str):
+        for news_filter in self.config["filters"]:
+            if news_filter in message_content or news_filter in news_content:
+                logging.info(f"Tenant {self.name}: Filtered news by {news_filter}.")
+                return
+        self._service.create_news(message_content, news_content, self.config["webhooks"])
+
+    def emit_event(self, event_type: str, data: dict):
+        # Filters only apply to news, events keep every change
+        self._service.emit_event(event_type, data, self.name)
@@ -0,0 +1,31 @@
+from abc import ABC, abstractmethod
+
+
+class UpdateChecker(ABC):
+
+    def __init__(self, service):
+        # AutoNewsService or a TenantContext
+        self.service = service
+        self.http_client = service.http_client
+        self.metrics = service.metrics
+
+    def get_state(self, config_key: str):
+        # Each grabber owns the snapshot named after its class
+        return self.service.get_from_save_data(type(self).__name__, config_key)
+
+    def set_state(self, config_key: str, value):
+        self.service.add_save_data(type(self).__name__, config_key, value)
+
+    def emit_event(self, event_type: str, **data):
+        # Typed record of a change, kept in the event store next to the news
+        self.service.emit_event(event_type, data)
+
+    @abstractmethod
+    def get_interval(self) -> int:
+        # Seconds between runs, the scheduler shortens it after changes and stretches it while idle
+        pass
+
+    @abstractmethod
+    def tick(self) -> bool:
+        # Returns whether a change was found
+        pass
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+
+from aiohttp import ClientError, ClientSession, TCPConnector, web
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from auth_store import STORE_BACKENDS, JsonLinesAuthStore, SqliteAuthStore  # noqa: E402
+
+APP_PATH = Path(__file__).parent.parent / "src" / "discord_auth_app.py"
+
+
+class StandInTokenEndpoint:
+    # Answers the token exchange like discord after a delay, so nothing touches the network
+
+    def __init__(self, latency: float, failure_rate: float):
+        self._latency = latency
+        self._failure_rate = failure_rate
+        self.exchanges = 0
+        self._runner = None
+        self.url = None
+
+    async def _exchange(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        self.exchanges += 1
+        await asyncio.sleep(self._latency)
+        if random.random() < self._failure_rate:
+            return web.json_response({"message": "Service unavailable"}, status=503)
+        return web.json_response({
+            "access_token": f"access-{form['code']}",
+            "token_type": "Bearer",
+            "expires_in": 604800,
+            "refresh_token": f"refresh-{form['code']}",
+            "scope": "webhook.incoming",
+            "webhook": {"id": form["code"], "token": f"webhook-{form['code']}"}
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/oauth2/token", self._exchange)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self._runner.addresses[0][1]}/api/oauth2/token"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+def _free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+async def _wait_until_ready(session: ClientSession, url: str, process: subprocess.Popen):
+    while process.poll() is None:
+        try:
+            async with session.get(url):
+                return
+        except ClientError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("The app exited before accepting requests.")
+
+
+async def _load(session: ClientSession, url: str, requests: int, concurrency: int, offset: int) -> tuple:
+    latencies = []
+    statuses = Counter()
+    codes = iter(range(offset, offset + requests))
+
+    async def worker():
+        for code in codes:
+            start = perf_counter()
+            try:
+                async with session.get(url, params={"code": str(code)}) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except ClientError as exception:
+                statuses[type(exception).__name__] += 1
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return perf_counter() - start, latencies, statuses
+
+
+async def run(stages: list, requests: int, latency: float, failure_rate: float, backend: str, timeout: float,
+              connection_limit: int):
+    endpoint = StandInTokenEndpoint(latency, failure_rate)
+    await endpoint.start()
+    with tempfile.TemporaryDirectory() as directory:
+        port = _free_port()
+        store_path = os.path.join(directory, "auths.db" if backend == "sqlite" else "auths.jsonl")
+        environment = dict(os.environ, PORT=str(port), DISCORD_TOKEN_URL=endpoint.url, AUTH_STORE_BACKEND=backend,
+                           AUTH_STORE_PATH=store_path, DISCORD_TIMEOUT=str(timeout), DISCORD_CLIENT_ID="bench",
+                           DISCORD_CLIENT_SECRET="bench", DISCORD_REDIRECT_URL="http://127.0.0.1/",
+                           DISCORD_CONNECTION_LIMIT=str(connection_limit))
+        process = subprocess.Popen([sys.executable, str(APP_PATH)], cwd=directory, env=environment,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}/"
+        try:
+            async with ClientSession(connector=TCPConnector(limit=0)) as session:
+                await _wait_until_ready(session, url, process)
+                print(f"{requests} callback(s) per stage, token endpoint latency {latency * 1000:.0f}ms, "
+                      f"{backend} store, {connection_limit} connection(s) to discord")
+                print(f"{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}  statuses")
+                stored = 0
+                for stage, concurrency in enumerate(stages):
+                    duration, latencies, statuses = await _load(session, url, requests, concurrency,
+                                                                stage * requests)
+                    stored += statuses[204]
+                    percentiles = quantiles(latencies, n=100, method="inclusive")
+                    print(f"{concurrency:>12}{requests / duration:>10.1f}{percentiles[49] * 1000:>10.1f}"
+                          f"{percentiles[89] * 1000:>10.1f}{percentiles[98] * 1000:>10.1f}  "
+                          f"{', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str))}")
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            await endpoint.close()
+
+        # Every accepted callback has to be kept, none may overwrite another
+        store = SqliteAuthStore(store_path) if backend == "sqlite" else JsonLinesAuthStore(store_path)
+        kept = store.count()
+        store.close()
+        print(f"Stored {kept}/{stored} accepted auth(s), {endpoint.exchanges} token exchange(s).")
+        return kept == stored
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Load tests the interaction setup app against a local "
+                                                          "stand-in of the discord token endpoint.")
+    argument_parser.add_argument("--stages", default="1,10,50,200", help="Comma separated concurrent callers.")
+    argument_parser.add_argument("--requests", type=int, default=1000, help="Callbacks per stage.")
+    argument_parser.add_argument("--latency-ms", type=float, default=100, help="Delay of the token endpoint.")
+    argument_parser.add_argument("--failure-rate", type=float, default=0.0,
+                                 help="Share of token exchanges answered with 503.")
+    argument_parser.add_argument("--backend", choices=sorted(STORE_BACKENDS), default="sqlite")
+    argument_parser.add_argument("--connection-limit", type=int, default=20,
+                                 help="DISCORD_CONNECTION_LIMIT of the app, exchanges in flight at once.")
+    argument_parser.add_argument("--timeout", type=float, default=10, help="DISCORD_TIMEOUT of the app.")
+    arguments = argument_parser.parse_args()
+    passed = asyncio.run(run([int(stage) for stage in arguments.stages.split(",")], arguments.requests,
+                             arguments.latency_ms / 1000, arguments.failure_rate, arguments.backend,
+                             arguments.timeout, arguments.connection_limit))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
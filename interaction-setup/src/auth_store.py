@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+
+
+class AuthStore(ABC):
+    # Keeps the token responses of discord, one entry per auth
+
+    @abstractmethod
+    def add(self, data: dict, created: str = None) -> None:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteAuthStore(AuthStore):
+    # Rows get their own id, so auths at the same time don't overwrite each other
+
+    def __init__(self, path: str):
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS auths (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                     "created TEXT NOT NULL, data TEXT NOT NULL)")
+
+    def add(self, data: dict, created: str = None) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("INSERT INTO auths (created, data) VALUES (?, ?)",
+                                     (created or str(datetime.now()), json.dumps(data)))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM auths").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class JsonLinesAuthStore(AuthStore):
+    # Append only, one line per auth
+
+    def __init__(self, path: str):
+        self._lock = Lock()
+        self._path = path
+
+    def add(self, data: dict, created: str = None) -> None:
+        line = json.dumps({"created": created or str(datetime.now()), "data": data}) + "\n"
+        with self._lock, open(self._path, "a", encoding="UTF-8") as file_out:
+            file_out.write(line)
+            file_out.flush()
+            os.fsync(file_out.fileno())
+
+    def count(self) -> int:
+        with self._lock:
+            try:
+                with open(self._path, "r", encoding="UTF-8") as file_in:
+                    return sum(1 for line in file_in if line.strip() != "")
+            except FileNotFoundError:
+                return 0
+
+
+# Store factories by AUTH_STORE_BACKEND
+STORE_BACKENDS = {
+    "sqlite": lambda: SqliteAuthStore(os.getenv("AUTH_STORE_PATH", "./auths.db")),
+    "jsonl": lambda: JsonLinesAuthStore(os.getenv("AUTH_STORE_PATH", "./auths.jsonl"))
+}
+
+
+def create_auth_store() -> AuthStore:
+    backend = os.getenv("AUTH_STORE_BACKEND", "sqlite")
+    if backend.lower() not in STORE_BACKENDS:
+        raise ValueError(f"Unknown auth store backend {backend}.")
+    return STORE_BACKENDS[backend.lower()]()
+
+
+def import_legacy_auths(auth_store: AuthStore, directory: str) -> int:
+    # Auths of the flask app were files named by their time. The directory is claimed by renaming it first, so of
+    # several workers starting together only one imports them, and only once
+    path = Path(directory)
+    if not path.is_dir():
+        return 0
+    claimed = path.with_name(f"{path.name}.importing-{os.getpid()}")
+    try:
+        path.rename(claimed)
+    except FileNotFoundError:
+        # Another worker was faster
+        return 0
+    imported = 0
+    for file in sorted(claimed.glob("*.json")):
+        try:
+            with open(file, "r", encoding="UTF-8") as file_in:
+                data = json.load(file_in)
+        except (OSError, ValueError) as exception:
+            logging.warning(f"Skipping legacy auth {file.name}: {exception}")
+            continue
+        # The colons of the time were replaced for the file name
+        day, _, time = file.stem.partition(" ")
+        auth_store.add(data, f"{day} {time.replace('-', ':')}" if time != "" else None)
+        imported += 1
+    try:
+        claimed.rename(path.with_name(f"{path.name}.imported"))
+    except OSError as exception:
+        logging.warning(f"Imported legacy auths stay in {claimed.name}: {exception}")
+    return imported
@@ -1,68 +1,100 @@
+import asyncio
 import json
-from datetime import datetime
+import logging
 from os import getenv
-from pathlib import Path
 
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector, web
 from dotenv import load_dotenv
-from flask import Flask, request, abort
-from requests import post, HTTPError
+
+from auth_store import AuthStore, create_auth_store, import_legacy_auths
 
 # Loading .env file
 load_dotenv()
 
+SESSION = web.AppKey("session", ClientSession)
+AUTH_STORE = web.AppKey("auth_store", AuthStore)
+
 
 class CodeRequest:
     _discord_client_id: str = getenv("DISCORD_CLIENT_ID")
     _discord_client_secret: str = getenv("DISCORD_CLIENT_SECRET")
     _discord_redirect_url: str = getenv("DISCORD_REDIRECT_URL")
+    _discord_token_url: str = getenv("DISCORD_TOKEN_URL", "https://discord.com/api/oauth2/token")
 
     def __init__(self, code: str):
         self._code: str = code
-        self.failed = False
-        # Timestamp of the request
-        self._timestamp = str(datetime.now())
-
-    def authenticate(self):
-        # Do request to discord
-        auth_request = post("https://discord.com/api/oauth2/token", data={
-            "client_id": self._discord_client_id,
-            "client_secret": self._discord_client_secret,
-            "grant_type": "authorization_code",
-            "code": self._code,
-            "redirect_uri": self._discord_redirect_url
-        }, headers={"Content-Type": "application/x-www-form-urlencoded"})
 
+    async def authenticate(self, session: ClientSession, auth_store: AuthStore) -> int:
+        # Returns the status for the callback
         try:
-            auth_request.raise_for_status()
-            data = auth_request.json()
-        except (HTTPError, json.JSONDecodeError):
-            self.failed = True
-            return self
+            # Do request to discord
+            async with session.post(self._discord_token_url, data={
+                "client_id": self._discord_client_id,
+                "client_secret": self._discord_client_secret,
+                "grant_type": "authorization_code",
+                "code": self._code,
+                "redirect_uri": self._discord_redirect_url
+            }, headers={"Content-Type": "application/x-www-form-urlencoded"}) as auth_response:
+                if auth_response.status >= 500 or auth_response.status == 429:
+                    logging.warning(f"Token exchange failed with {auth_response.status}.")
+                    return 502
+                if auth_response.status >= 400:
+                    return 400
+                data = await auth_response.json(content_type=None)
+        except json.JSONDecodeError:
+            return 400
+        except (ClientError, asyncio.TimeoutError) as exception:
+            logging.warning(f"Token exchange failed: {exception!r}")
+            return 502
+
+        # The store blocks, so it runs next to the event loop
+        await asyncio.to_thread(auth_store.add, data)
+        return 204
+
+
+async def apply_discord_code(request: web.Request) -> web.Response:
+    # Check for code from discord
+    discord_code: str = request.query.get("code")
+    if discord_code is None:
+        raise web.HTTPBadRequest()
 
-        self._write(data)
+    status = await CodeRequest(discord_code).authenticate(request.app[SESSION], request.app[AUTH_STORE])
+    if status != 204:
+        raise web.HTTPBadRequest() if status == 400 else web.HTTPBadGateway()
+    return web.Response(status=204)
 
-        return self
 
-    def _write(self, data: dict):
-        # Create file if not exists
-        Path("./auths").mkdir(exist_ok=True)
-        # Open and write file
-        with open(f"./auths/{self._timestamp.replace(':', '-')}.json", "w", encoding="UTF-8") as file:
-            json.dump(data, file, indent=4)
+async def _client_context(app: web.Application):
+    # One pooled session for all callbacks, a slow discord can't hold them forever
+    connector = TCPConnector(limit=int(getenv("DISCORD_CONNECTION_LIMIT", "20")))
+    timeout = ClientTimeout(total=float(getenv("DISCORD_TIMEOUT", "10")))
+    async with ClientSession(connector=connector, timeout=timeout) as session:
+        app[SESSION] = session
+        yield
 
 
-web_app = Flask(__name__)
+async def _store_context(app: web.Application):
+    app[AUTH_STORE] = create_auth_store()
+    imported = import_legacy_auths(app[AUTH_STORE], getenv("LEGACY_AUTHS_DIR", "./auths"))
+    if imported > 0:
+        logging.info(f"Imported {imported} auth(s) written by the flask app.")
+    yield
+    app[AUTH_STORE].close()
 
 
-@web_app.route("/", methods=["GET"])
-def apply_discord_code():
-    # Check for code from discord
-    discord_code: str = request.args.get("code")
-    if discord_code is None:
-        abort(400)
+def create_app() -> web.Application:
+    web_app = web.Application()
+    web_app.cleanup_ctx.append(_store_context)
+    web_app.cleanup_ctx.append(_client_context)
+    web_app.router.add_get("/", apply_discord_code)
+    return web_app
+
+
+# Replaces the flask app for deployments serving the module, it's no WSGI app anymore though:
+# gunicorn discord_auth_app:web_app --worker-class aiohttp.GunicornWebWorker
+web_app = create_app()
 
-    # Make request and check if failed
-    if CodeRequest(discord_code).authenticate().failed:
-        abort(400)
 
-    return "", 204
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="(%(asctime)s) [%(levelname)s] %(message)s")
+    web.run_app(web_app, host=getenv("HOST", "127.0.0.1"), port=int(getenv("PORT", "5000")))